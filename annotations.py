@@ -0,0 +1,21 @@
+# Compact annotation of a drawn box, in original-image coordinates.
+# Kept out of app.py: the script is re-executed on every rerun, which would redefine the class and
+# break isinstance checks against annotations created in earlier runs.
+class Annotation:
+    __slots__ = ('page', 'x', 'y', 'w', 'h', 'field_id', 'text')
+
+    def __init__(self, page, x, y, w, h, field_id=None, text=None):
+        self.page = page
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+        self.field_id = field_id
+        self.text = text
+
+    def to_list(self):
+        return [self.page, self.x, self.y, self.w, self.h, self.field_id, self.text]
+
+    @classmethod
+    def from_list(cls, values):
+        return cls(*values)
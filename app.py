@@ -1,15 +1,31 @@
+import time
+# Taken before the other imports so that the cold start figure includes them
+SCRIPT_STARTED = time.time()
+
 import streamlit as st
-from PIL import Image, ImageFilter
+from PIL import Image
 import numpy as np
-import pytesseract
-from streamlit_drawable_canvas import st_canvas
-import requests
 import json
 import base64
 import re
 import io
-import fitz  # PyMuPDF
-import pyperclip
+import os
+import sys
+import tempfile
+import threading
+import hashlib
+import functools
+import collections
+import difflib
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from annotations import Annotation
+from disk_cache import DiskCache, make_key
+from duplicate_index import DuplicateIndex, content_tokens, dhash
+from layout_analysis import propose_text_blocks
+from metrics import MetricsRegistry, start_metrics_server
+from roi_ocr import ocr_page_words, ocr_region, render_pdf_page, words_in_rect
 
 st.set_page_config(
     page_title="Document Viewer App",
@@ -18,89 +34,944 @@ st.set_page_config(
 )
 
 # Configure the path to Tesseract if necessary
-pytesseract.pytesseract.tesseract_cmd = r'C:\\Program Files\\Tesseract-OCR\\tesseract.exe'
+TESSERACT_CMD = os.environ.get("TESSERACT_CMD", r'C:\\Program Files\\Tesseract-OCR\\tesseract.exe')
+
+# Heavy modules are imported on first use (or by the background prewarm), not before the first paint
+HEAVY_MODULES = ["fitz", "pytesseract", "pyperclip", "streamlit_drawable_canvas"]
+
+# HTTP connection pool shared by all sessions
+HTTP_POOL_SIZE = 16
+HTTP_TIMEOUT = 30  # seconds
+
+# Prometheus-style metrics served at http://METRICS_HOST:METRICS_PORT/metrics (METRICS_PORT=0 disables the endpoint)
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9464"))
+
+# Startup instrumentation
+TIME_TO_FIRST_RENDER_TARGET = float(os.environ.get("TIME_TO_FIRST_RENDER_TARGET", "1.5"))  # seconds
+PREWARM_WAIT_TIMEOUT = 30  # seconds to wait for the document type catalog
+
+# Document type catalog endpoint
+EDMS_API_URL = os.environ.get("EDMS_API_URL", "https://edms-demo.epik.live/api/v4")
+
+# How long metadata and document types fetched from the API are reused
+API_CACHE_TTL = 600  # seconds
+
+# Decompression bomb guard: Pillow warns above this many pixels and refuses images over twice as large.
+# The default is Pillow's own (about 89 MP, roughly 270 MB decoded as RGB); it can only be lowered.
+Image.MAX_IMAGE_PIXELS = min(int(os.environ.get("MAX_IMAGE_PIXELS", "89478485")), 89478485)
+
+# Disk cache of rendered pages, thumbnails and OCR results shared by all app processes on this host
+DISK_CACHE_DIR = os.environ.get("DISK_CACHE_DIR", os.path.join(tempfile.gettempdir(), "document_viewer_cache"))
+DISK_CACHE_MAX_BYTES = int(os.environ.get("DISK_CACHE_MAX_MB", "2048")) * 1024 * 1024
+RENDER_DPI = 300
+
+# OCR settings (see ocr_benchmark.py to compare alternatives). Language and preprocessing apply to region OCR
+# and to the background page OCR of queued documents; the page segmentation mode is set separately for each.
+OCR_LANG = os.environ.get("OCR_LANG", "eng")
+OCR_PSM = os.environ.get("OCR_PSM") or None
+OCR_PAGE_PSM = os.environ.get("OCR_PAGE_PSM") or None
+OCR_PREPROCESSING = os.environ.get("OCR_PREPROCESSING", "none")
+
+# Submission endpoint. In "chunked" mode the file is sent in checksummed chunks that can be resumed
+# from the last offset acknowledged by the server instead of one monolithic JSON body.
+DMS_API_URL = os.environ.get("DMS_API_URL", "https://dms.api.epik.live/api")
+UPLOAD_MODE = os.environ.get("UPLOAD_MODE", "monolithic")
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE_KB", "1024")) * 1024
+UPLOAD_TIMEOUT = 60  # seconds per request
+UPLOAD_MAX_RETRIES = 5  # consecutive failed chunk attempts before giving up
+
+# Optional recompression of the uploaded file before it is base64-encoded for submission.
+# Per-document-type overrides are read from PAYLOAD_OPTIMIZATION_CONFIG, a JSON object keyed by
+# document type id (or "default") whose values override the settings below.
+PAYLOAD_OPTIMIZATION_CONFIG = os.environ.get("PAYLOAD_OPTIMIZATION_CONFIG", "payload_optimization.json")
+DEFAULT_PAYLOAD_OPTIMIZATION = {
+    "enabled": False,
+    "png_optimize": True,  # lossless PNG optimization
+    "jpeg_quality": 85,  # re-encode JPEG at this quality (None keeps the original encoding unless max_dpi downscales the image)
+    "webp_quality": None,  # re-encode images as WebP at this quality (None to keep the format)
+    "max_dpi": 300,  # downscale images scanned above this DPI (None for no cap)
+    "pdf_recompress": True,  # garbage-collect and deflate PDF streams with PyMuPDF
+}
+
+EXIF_ORIENTATION = 0x0112  # the only EXIF tag carried over to a re-encoded image
+
+# Duplicate detection of submissions: "warn" asks for confirmation, "skip" refuses exact re-uploads, "off" disables.
+# Near-duplicates (same layout and same first-page amounts, dates and numbers) only ever ask for confirmation.
+DUPLICATE_POLICY = os.environ.get("DUPLICATE_POLICY", "warn")
+DUPLICATE_INDEX_PATH = os.environ.get("DUPLICATE_INDEX_PATH", "duplicate_index.sqlite3")
+DUPLICATE_MAX_DISTANCE = int(os.environ.get("DUPLICATE_MAX_DISTANCE", "3"))  # bits of the 64-bit dHash
+DUPLICATE_MIN_TEXT_SIMILARITY = float(os.environ.get("DUPLICATE_MIN_TEXT_SIMILARITY", "1.0"))  # Jaccard similarity of the first-page tokens with digits
+
+# Background preprocessing of queued uploads
+PREPROCESS_WORKERS = int(os.environ.get("PREPROCESS_WORKERS", "2"))
+QUEUE_REFRESH_INTERVAL = 2  # seconds between queue status refreshes
+THUMBNAIL_SIZE = (160, 160)
+
+# Memory limits for cached images, arrays and canvas data (per session and across all sessions)
+SESSION_MEMORY_LIMIT = int(os.environ.get("SESSION_MEMORY_LIMIT_MB", "256")) * 1024 * 1024
+GLOBAL_MEMORY_LIMIT = int(os.environ.get("GLOBAL_MEMORY_LIMIT_MB", "2048")) * 1024 * 1024
+SESSION_IDLE_TIMEOUT = 3600  # seconds before an inactive session is dropped from the registry (its spill files are kept)
+SPILL_DIR = os.environ.get("SPILL_DIR", os.path.join(tempfile.gettempdir(), "document_viewer_spill"))
+SPILL_RETENTION = int(os.environ.get("SPILL_RETENTION_HOURS", "168")) * 3600  # seconds before an untouched spill file is removed
+SPILL_CLEANUP_INTERVAL = 3600  # seconds between scans for expired spill files
+RENDER_CACHE_ENTRIES = 32  # full-resolution and display-sized pages kept in memory, shared by all sessions
+
+# Dataset export of submitted annotations (docs/json word-box format, sharded JSONL)
+EXPORT_DIR = os.environ.get("EXPORT_DIR", "exports")
+EXPORT_SHARD_SIZE = 1000  # records per shard
+EXPORT_MATCH_RATIO = 0.8  # similarity of a box's OCR text to a submitted value for the box to take that field's label
+
+# Canvas rectangle style
+CANVAS_FILL_COLOR = "rgba(255, 0, 0, 0.3)"
+CANVAS_STROKE_COLOR = "rgba(255, 0, 0, 1)"
+CANVAS_STROKE_WIDTH = 2
+
+# Style of the proposed text blocks shown in click-to-select mode
+PROPOSAL_FILL_COLOR = "rgba(0, 120, 255, 0.08)"
+PROPOSAL_STROKE_COLOR = "rgba(0, 120, 255, 0.8)"
+
+# Function to import a module on first use
+@functools.lru_cache(maxsize=None)
+def lazy_import(module_name):
+    return importlib.import_module(module_name)
+
+# Function to get the OCR engine, configured once per process
+@st.cache_resource(show_spinner=False)
+def get_ocr_engine():
+    pytesseract = lazy_import("pytesseract")
+    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+    return pytesseract
+
+# Function to get the pooled HTTP session, created once per process
+@st.cache_resource(show_spinner=False)
+def get_http_session():
+    requests = lazy_import("requests")
+    adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# Function to get the metrics registry of the process, serving it on first use
+@st.cache_resource(show_spinner=False)
+def get_metrics():
+    registry = MetricsRegistry()
+    registry.gauge("ocr_queue_depth", "Uploaded documents waiting for or in background rasterization and pre-OCR")
+    registry.histogram("ocr_seconds", "Duration of OCR runs that missed the cache", ["kind"])
+    registry.histogram("render_seconds", "Duration of page renders that missed the cache", ["kind"])
+    registry.counter("render_requests_total", "Pages requested for display or preprocessing", ["kind"])
+    registry.counter("render_cache_misses_total", "Page requests missing the in-memory tier (memory) and pages actually rendered (disk); plain images bypass the disk tier", ["kind", "tier"])
+    registry.counter("disk_cache_requests_total", "Disk cache lookups by entry kind and result", ["kind", "result"])
+    registry.histogram("edms_request_seconds", "Duration of EDMS catalog requests", ["endpoint"])
+    registry.counter("edms_request_failures_total", "EDMS catalog requests answered with an error status", ["endpoint"])
+    registry.histogram("submission_seconds", "Duration of submissions to the DMS")
+    registry.counter("submission_failures_total", "Failed submissions to the DMS by status code (or 'error' when no response)", ["status"])
+
+    # Sampled at scrape time from the disk cache index and the memory registry
+    cache = get_disk_cache()
+    registry.gauge("disk_cache_bytes", "Size of the disk cache").set_function(cache.total_size)
+    memory = get_memory_registry()
+
+    def session_memory():
+        with memory['lock']:
+            return {(session_id,): entry['bytes'] for session_id, entry in memory['sessions'].items()}
 
-# Function to load document types from API
+    registry.gauge("session_memory_bytes", "Estimated memory of the cached images, arrays and canvas data of a session", ["session"]).set_function(session_memory)
+
+    if METRICS_PORT:
+        try:
+            start_metrics_server(registry, METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            print(f"Error starting the metrics endpoint on {METRICS_HOST}:{METRICS_PORT}: {e}")
+    return registry
+
+# Function to run one prewarm step and record how long it took
+def run_prewarm_step(state, name, step):
+    started = time.perf_counter()
+    try:
+        step()
+    except Exception as e:
+        print(f"Prewarm step {name} failed: {e}")
+    state['timings'][name] = time.perf_counter() - started
+    state['events'][name].set()
+
+# Function to initialize the metrics endpoint, HTTP pool, document type catalog, heavy modules and OCR engine
+def prewarm(state):
+    run_prewarm_step(state, 'metrics', get_metrics)
+    run_prewarm_step(state, 'http_pool', get_http_session)
+    run_prewarm_step(state, 'doctype_catalog', get_document_types)
+    run_prewarm_step(state, 'imports', lambda: [lazy_import(module_name) for module_name in HEAVY_MODULES])
+    run_prewarm_step(state, 'ocr_engine', lambda: get_ocr_engine().get_tesseract_version())
+
+# Function to start the background prewarm once per process
+@st.cache_resource(show_spinner=False)
+def start_prewarm():
+    steps = ['metrics', 'http_pool', 'doctype_catalog', 'imports', 'ocr_engine']
+    state = {
+        # Start of the first script run of the process (module-level code is re-executed on every run)
+        'started': SCRIPT_STARTED,
+        'first_render': None,
+        'timings': {},
+        'events': {name: threading.Event() for name in steps},
+    }
+    # Process-wide work: the thread is not attached to the context of the session that happened to start it
+    thread = threading.Thread(target=prewarm, args=(state,), name="prewarm", daemon=True)
+    thread.start()
+    return state
+
+# Function to record and report the time to first render of the process and the session
+def report_startup(state, run_started):
+    now = time.time()
+    if state['first_render'] is None:
+        state['first_render'] = now - state['started']
+        print(f"Time to first render (cold start): {state['first_render']:.2f}s (target {TIME_TO_FIRST_RENDER_TARGET:.2f}s)")
+    if 'first_render' not in st.session_state:
+        st.session_state['first_render'] = now - run_started
+        print(f"Time to first render (session {get_session_id()}): {st.session_state['first_render']:.2f}s")
+
+    with st.sidebar.expander("Startup"):
+        st.caption(f"Cold start to first render: {state['first_render']:.2f}s")
+        st.caption(f"Session first render: {st.session_state['first_render']:.2f}s")
+        for name, seconds in state['timings'].items():
+            st.caption(f"Prewarm {name}: {seconds:.2f}s")
+        if max(state['first_render'], st.session_state['first_render']) > TIME_TO_FIRST_RENDER_TARGET:
+            st.warning(f"Time to first render is above the {TIME_TO_FIRST_RENDER_TARGET:.1f}s target")
+
+# Function to load document types from API. Errors raise (requests.RequestException) so that they are not cached.
+@st.cache_data(ttl=API_CACHE_TTL, show_spinner=False)
 def get_document_types():
-    url = "https://edms-demo.epik.live/api/v4/document_types/"
+    url = f"{EDMS_API_URL}/document_types/"
     document_types = []
     next_url = url
     while next_url:
-        response = requests.get(next_url, auth=('admin', '1234@BCD'))
+        with get_metrics()["edms_request_seconds"].time(endpoint="document_types"):
+            response = get_http_session().get(next_url, auth=('admin', '1234@BCD'), timeout=HTTP_TIMEOUT)
         if response.status_code == 200:
             data = response.json()
             document_types.extend(data['results'])
             next_url = data['next']
         else:
-            return []
+            get_metrics()["edms_request_failures_total"].inc(endpoint="document_types")
+            response.raise_for_status()
     return document_types
 
-# Function to load metadata types from API
+# Function to load metadata types from API. Errors raise (requests.RequestException) so that they are not cached.
+@st.cache_data(ttl=API_CACHE_TTL, show_spinner=False)
 def get_metadata_types(doc_type_id):
-    url = f"https://edms-demo.epik.live/api/v4/document_types/{doc_type_id}/metadata_types/"
-    response = requests.get(url, auth=('admin', '1234@BCD'))
-    if response.status_code == 200:
-        return response.json()['results']
-    else:
-        return []
+    url = f"{EDMS_API_URL}/document_types/{doc_type_id}/metadata_types/"
+    with get_metrics()["edms_request_seconds"].time(endpoint="metadata_types"):
+        response = get_http_session().get(url, auth=('admin', '1234@BCD'), timeout=HTTP_TIMEOUT)
+    if response.status_code != 200:
+        get_metrics()["edms_request_failures_total"].inc(endpoint="metadata_types")
+        response.raise_for_status()
+    return response.json()['results']
+
+# Function to get the disk cache shared with the other app processes
+@st.cache_resource(show_spinner=False)
+def get_disk_cache():
+    return DiskCache(DISK_CACHE_DIR, DISK_CACHE_MAX_BYTES)
+
+# Function to get the content hash of a file, used in disk cache keys
+def get_content_hash(file_bytes):
+    return hashlib.sha256(file_bytes).hexdigest()
+
+# Function to read a value from the disk cache, or compute and store it; kind labels the lookup in the metrics.
+# decode reads the mapped blob (file-like and a buffer) without copying it first.
+def disk_cached(kind, key, compute, encode, decode):
+    cache = get_disk_cache()
+    requests_total = get_metrics()["disk_cache_requests_total"]
+    try:
+        value = cache.get(key, decode)
+        if value is not None:
+            requests_total.inc(kind=kind, result="hit")
+            return value
+    except Exception as e:
+        print(f"Error reading disk cache entry {key}: {e}")
+    requests_total.inc(kind=kind, result="miss")
+    value = compute()
+    try:
+        cache.set(key, encode(value))
+    except Exception as e:
+        print(f"Error writing disk cache entry {key}: {e}")
+    return value
+
+# Function to encode an image as PNG (fast compression, used for cache blobs)
+def encode_png(img, compress_level=1):
+    img_bytes = io.BytesIO()
+    img.save(img_bytes, format='PNG', compress_level=compress_level)
+    return img_bytes.getvalue()
+
+# Function to decode a mapped PNG cache blob
+def decode_png(data):
+    img = Image.open(data)
+    img.load()
+    return img
 
 # Function to perform OCR on the selected region
-def perform_ocr(image, rect):
+def perform_ocr(image, rect, cache_key=None):
     left, top, width, height = rect["left"], rect["top"], rect["width"], rect["height"]
-    roi = image[top:top + height, left:left + width]
-    text = pytesseract.image_to_string(roi, lang='eng')
-    return text.strip()
+
+    def ocr():
+        with get_metrics()["ocr_seconds"].time(kind="region"):
+            return ocr_region(get_ocr_engine(), image, rect, OCR_LANG, OCR_PSM, OCR_PREPROCESSING)
+
+    if cache_key is None:
+        return ocr()
+    key = make_key("ocr", cache_key, left, top, width, height, OCR_LANG, OCR_PSM, OCR_PREPROCESSING)
+    return disk_cached("ocr", key, ocr, lambda text: text.encode('utf-8'), lambda data: str(data, 'utf-8'))
+
+# Function to OCR a whole page into word boxes (x, y, w, h, text, line)
+def get_page_words(image, cache_key=None):
+    if cache_key is not None:
+        return disk_cached(
+            "words", make_key("words", cache_key, OCR_LANG, OCR_PAGE_PSM, OCR_PREPROCESSING), lambda: get_page_words(image),
+            lambda words: json.dumps(words).encode('utf-8'),
+            lambda data: [(x, y, w, h, text, tuple(line)) for x, y, w, h, text, line in json.loads(str(data, 'utf-8'))],
+        )
+    with get_metrics()["ocr_seconds"].time(kind="page"):
+        return ocr_page_words(get_ocr_engine(), image, OCR_LANG, OCR_PAGE_PSM, OCR_PREPROCESSING)
 
 # Function to load image
 def load_image(image_file):
     return Image.open(image_file)
 
-# Function to display PDF and convert to image with navigation
-def display_pdf_and_convert_to_image(uploaded_file):
-    images = []
-    original_sizes = []
+# Function to get the kind of an uploaded document: 'pdf', 'tiff' (possibly multi-page) or 'image'
+def get_file_kind(uploaded_file):
+    extension = os.path.splitext(uploaded_file.name)[1].lower()
+    if uploaded_file.type == "application/pdf" or extension == ".pdf":
+        return "pdf"
+    if uploaded_file.type == "image/tiff" or extension in (".tif", ".tiff"):
+        return "tiff"
+    return "image"
+
+# Function to get the number of pages of a document
+@st.cache_data(max_entries=32, show_spinner=False)
+def get_page_count(file_bytes, file_kind):
+    if file_kind == "tiff":
+        # Only the frame headers are read, no frame is decoded
+        with Image.open(io.BytesIO(file_bytes)) as img:
+            return getattr(img, "n_frames", 1)
+    if file_kind != "pdf":
+        return 1
+    with lazy_import("fitz").open(stream=file_bytes, filetype="pdf") as doc:
+        return len(doc)
+
+# Function to get the in-memory tier of the render cache, shared by all sessions: entries and their sizes in least recently used order
+@st.cache_resource
+def get_render_cache():
+    return {"lock": threading.Lock(), "entries": collections.OrderedDict(), "bytes": 0}
+
+# Function to read an entry from the in-memory render cache, or compute and store it
+def render_cached(key, compute):
+    cache = get_render_cache()
+    with cache['lock']:
+        entry = cache['entries'].get(key)
+        if entry is not None:
+            cache['entries'].move_to_end(key)
+            return entry[0]
+    value = compute()
+    size = estimate_size(value)
+    with cache['lock']:
+        if key not in cache['entries']:
+            cache['entries'][key] = (value, size)
+            cache['bytes'] += size
+            while len(cache['entries']) > RENDER_CACHE_ENTRIES:
+                cache['bytes'] -= cache['entries'].popitem(last=False)[1][1]
+    return value
+
+# Function to evict the least recently used entries of the in-memory render cache until nbytes are freed.
+# Evicted pages are read back from the disk cache on next use; sessions showing them keep their own reference until their next run.
+def evict_render_cache(nbytes):
+    cache = get_render_cache()
+    freed = 0
+    with cache['lock']:
+        while cache['entries'] and freed < nbytes:
+            freed += cache['entries'].popitem(last=False)[1][1]
+        cache['bytes'] -= freed
+    return freed
+
+# Function to render a page of a document at full resolution
+def render_page(file_bytes, file_kind, page_number):
+    content_hash = get_content_hash(file_bytes)
+
+    def decode():
+        if file_kind == "tiff":
+            # Seek to the requested frame so only that frame is decoded
+            with Image.open(io.BytesIO(file_bytes)) as tiff:
+                tiff.seek(page_number)
+                return tiff.convert('RGB')
+        if file_kind != "pdf":
+            return load_image(io.BytesIO(file_bytes)).convert('RGB')
+        with lazy_import("fitz").open(stream=file_bytes, filetype="pdf") as doc:
+            return render_pdf_page(doc, page_number, RENDER_DPI)
+
+    def render():
+        get_metrics()["render_cache_misses_total"].inc(kind=file_kind, tier="disk")
+        with get_metrics()["render_seconds"].time(kind=file_kind):
+            return decode()
+
+    def load():
+        # Only runs when the in-memory tier misses
+        get_metrics()["render_cache_misses_total"].inc(kind=file_kind, tier="memory")
+        # Plain images are already decoded faster than a cached PNG could be read back
+        if file_kind == "image":
+            img = render()
+        else:
+            img = disk_cached("page", make_key("page", content_hash, file_kind, page_number, RENDER_DPI), render, encode_png, decode_png)
+        return img, img.size
+
+    return render_cached(("page", content_hash, file_kind, page_number), load)
+
+# Function to get the downscaled page shown on the canvas, its scale factor and its PNG download
+def get_display_image(file_bytes, file_kind, page_number):
+    def resize():
+        img, original_size = render_page(file_bytes, file_kind, page_number)
+        if file_kind == "pdf":
+            # Scale down the image by a factor of 3 if it's a PDF
+            scale_factor = 3
+            new_width = original_size[0] // scale_factor
+            new_height = original_size[1] // scale_factor
+            img_resized = img.resize((new_width, new_height))
+        else:
+            # Fit the image within a specific area (max width 1500, max height 1500)
+            max_width = 1500
+            max_height = 1500
+            # Large scans are first shrunk by a cheap integer factor before the LANCZOS resize
+            reduce_factor = max(img.width // max_width, img.height // max_height)
+            img_resized = img.reduce(reduce_factor) if reduce_factor > 1 else img.copy()
+            img_resized.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
+            scale_factor = original_size[0] / img_resized.width
+
+        img_bytes = io.BytesIO()
+        img_resized.save(img_bytes, format='PNG')
+        return img_resized, scale_factor, img_bytes.getvalue()
+
+    return render_cached(("display", get_content_hash(file_bytes), file_kind, page_number), resize)
+
+# Function to propose text blocks of a page (x, y, w, h in original-image coordinates), computed on the downscaled page
+@st.cache_data(max_entries=64, show_spinner=False)
+def get_layout_proposals(file_bytes, file_kind, page_number):
+    def analyze():
+        img_resized, scale_factor, img_bytes = get_display_image(file_bytes, file_kind, page_number)
+        blocks = propose_text_blocks(np.asarray(img_resized.convert('L')))
+        return [[round(value * scale_factor) for value in block] for block in blocks]
+
+    key = make_key("layout", get_content_hash(file_bytes), file_kind, page_number)
+    return disk_cached("layout", key, analyze, lambda blocks: json.dumps(blocks).encode('utf-8'), lambda data: json.loads(str(data, 'utf-8')))
+
+# Function to get a small preview of the first page of a document
+@st.cache_data(max_entries=256, show_spinner=False)
+def get_thumbnail(file_bytes, file_kind):
+    def make_thumbnail():
+        img_resized, scale_factor, img_bytes = get_display_image(file_bytes, file_kind, 0)
+        thumbnail = img_resized.copy()
+        thumbnail.thumbnail(THUMBNAIL_SIZE)
+        thumbnail_bytes = io.BytesIO()
+        thumbnail.save(thumbnail_bytes, format='PNG')
+        return thumbnail_bytes.getvalue()
+
+    return disk_cached("thumbnail", make_key("thumbnail", get_content_hash(file_bytes), THUMBNAIL_SIZE), make_thumbnail, lambda data: data, bytes)
+
+# Function to rasterize, thumbnail and pre-OCR the first page of a queued document
+def preprocess_document(file_bytes, file_kind):
+    page_count = get_page_count(file_bytes, file_kind)
+    thumbnail = get_thumbnail(file_bytes, file_kind)
+    get_metrics()["render_requests_total"].inc(kind=file_kind)
+    img, original_size = render_page(file_bytes, file_kind, 0)
+    words = get_page_words(img, cache_key=(get_content_hash(file_bytes), 0))
+    return {"page_count": page_count, "thumbnail": thumbnail, "words": {0: words}}
+
+# Function to get the process-wide pool preprocessing queued documents
+@st.cache_resource(show_spinner=False)
+def get_preprocess_executor():
+    return ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS, thread_name_prefix="preprocess")
+
+# Function to get the status of a queued document
+def get_queue_status(entry):
+    if entry.get('submitted'):
+        return "submitted"
+    future = entry['future']
+    if not future.done():
+        return "processing" if future.running() else "queued"
+    return "failed" if future.exception() else "ready"
+
+# Function to get the preprocessing result of a queued document, if it is ready
+def get_preprocessed(file_key):
+    entry = st.session_state.get('upload_queue', {}).get(file_key)
+    if entry and entry['future'].done() and not entry['future'].exception():
+        return entry['future'].result()
+    return None
+
+# Function to add new uploads to the queue and drop removed ones
+def update_upload_queue(uploaded_files):
+    queue = st.session_state.setdefault('upload_queue', {})
+    file_keys = []
+    for uploaded_file in uploaded_files or []:
+        file_key = uploaded_file.name + str(uploaded_file.size)
+        file_keys.append(file_key)
+        if file_key not in queue:
+            queue_depth = get_metrics()["ocr_queue_depth"]
+            queue_depth.inc()
+            future = get_preprocess_executor().submit(preprocess_document, uploaded_file.getvalue(), get_file_kind(uploaded_file))
+            # Also called when the future is cancelled
+            future.add_done_callback(lambda future: queue_depth.dec())
+            queue[file_key] = {"file": uploaded_file, "future": future}
+    for file_key in [key for key in queue if key not in file_keys]:
+        queue.pop(file_key)['future'].cancel()
+        state = st.session_state.get('document_states', {}).pop(file_key, None)
+        if state:
+            remove_spilled_annotations(state['annotations'])
+        if st.session_state.get('current_document') == file_key:
+            # Drop the annotations of the removed document instead of stashing them under its key on the next switch
+            remove_spilled_annotations(st.session_state['annotations'])
+            st.session_state['annotations'] = {}
+            st.session_state['current_page'] = 0
+            st.session_state['page_sizes'] = {}
+            st.session_state['current_document'] = None
+            st.session_state['canvas_reset'] = True
+    return queue
+
+# Function to remove the spill files of a document's annotations
+def remove_spilled_annotations(annotations):
+    for page_annotations in annotations.values():
+        if is_spilled(page_annotations):
+            try:
+                os.remove(page_annotations['spilled'])
+            except OSError:
+                pass
+
+# Function to switch the per-document annotation state to another queued document
+def switch_document(file_key):
+    current = st.session_state.get('current_document')
+    if current == file_key:
+        return
+    states = st.session_state.setdefault('document_states', {})
+    if current is not None:
+        states[current] = {
+            'annotations': st.session_state['annotations'],
+            'current_page': st.session_state['current_page'],
+            'page_sizes': st.session_state.get('page_sizes', {}),
+        }
+    state = states.pop(file_key, {'annotations': {}, 'current_page': 0, 'page_sizes': {}})
+    st.session_state['annotations'] = state['annotations']
+    st.session_state['current_page'] = state['current_page']
+    st.session_state['page_sizes'] = state['page_sizes']
+    st.session_state['current_document'] = file_key
+    st.session_state['canvas_reset'] = True
+
+# Function to check whether some queued document is still waiting for or in preprocessing
+def has_pending_uploads():
+    return any(get_queue_status(entry) in ("queued", "processing") for entry in st.session_state.get('upload_queue', {}).values())
+
+# Function to display the queued documents with their preprocessing status
+def display_upload_queue():
+    queue = st.session_state.get('upload_queue', {})
+    for file_key, entry in list(queue.items()):
+        status = get_queue_status(entry)
+        col_thumb, col_status = st.columns([1, 3])
+        with col_thumb:
+            preprocessed = get_preprocessed(file_key)
+            if preprocessed:
+                st.image(preprocessed['thumbnail'])
+        with col_status:
+            st.caption(f"{entry['file'].name}: {status}")
+
+# Function to display the queue and refresh it while documents are being preprocessed
+@st.fragment(run_every=QUEUE_REFRESH_INTERVAL)
+def poll_upload_queue():
+    display_upload_queue()
+    if not has_pending_uploads():
+        # A full rerun replaces the polling fragment with the static list and shows the finished documents
+        st.rerun()
+
+# Function to display the page navigation of a PDF or multi-page TIFF
+def display_page_navigation(total_pages, document_label):
+    current_page = st.session_state.get('current_page', 0)
+
+    col_empty_PDF, col1_titlePDF, col2, col3, col4 = st.columns([1, 5, 2, 2, 1])
+    with col1_titlePDF:
+        st.markdown(f"#### Preview of the {document_label}:")
+
+    with col2:
+        if st.button('Previous page', key='prev_page'):
+            if current_page > 0:
+                st.session_state['canvas_reset'] = True  # Flag to reset canvas
+                current_page -= 1
+                st.session_state['current_page'] = current_page
+
+    with col3:
+        if st.button('Next page', key='next_page'):
+            if current_page < total_pages - 1:
+                st.session_state['canvas_reset'] = True  # Flag to reset canvas
+                current_page += 1
+                st.session_state['current_page'] = current_page
+
+# Function to convert annotations (and proposed text blocks) to the Fabric.js JSON expected by the canvas
+def annotations_to_canvas_json(page_annotations, scale_factor, proposals=()):
+    objects = [
+        {
+            "type": "rect",
+            "left": x / scale_factor,
+            "top": y / scale_factor,
+            "width": w / scale_factor,
+            "height": h / scale_factor,
+            "fill": PROPOSAL_FILL_COLOR,
+            "stroke": PROPOSAL_STROKE_COLOR,
+            "strokeWidth": 1,
+            "selectable": False,
+            "evented": False,
+        }
+        for x, y, w, h in proposals
+    ]
+    objects += [
+        {
+            "type": "rect",
+            "left": annotation.x / scale_factor,
+            "top": annotation.y / scale_factor,
+            "width": annotation.w / scale_factor,
+            "height": annotation.h / scale_factor,
+            "fill": CANVAS_FILL_COLOR,
+            "stroke": CANVAS_STROKE_COLOR,
+            "strokeWidth": CANVAS_STROKE_WIDTH,
+        }
+        for annotation in page_annotations
+    ]
+    return {"version": "4.4.0", "objects": objects}
+
+# Function to update the annotations of a page from the canvas objects, keeping the OCR text of unchanged boxes
+def sync_annotations(page, objects, scale_factor):
+    previous = load_page_annotations(page)
+    rects = [obj for obj in objects if obj.get("type") == "rect" and obj.get("stroke") != PROPOSAL_STROKE_COLOR]
+    page_annotations = []
+    for index, obj in enumerate(rects):
+        x = round(obj["left"] * scale_factor)
+        y = round(obj["top"] * scale_factor)
+        w = round(obj["width"] * obj.get("scaleX", 1) * scale_factor)
+        h = round(obj["height"] * obj.get("scaleY", 1) * scale_factor)
+        annotation = previous[index] if index < len(previous) else None
+        if annotation is None or (annotation.x, annotation.y, annotation.w, annotation.h) != (x, y, w, h):
+            annotation = Annotation(page, x, y, w, h)
+        page_annotations.append(annotation)
+    st.session_state['annotations'][page] = page_annotations
+    return page_annotations
+
+# Function to add an annotation for each clicked point, snapped to the smallest proposed text block containing it
+def snap_clicks_to_proposals(page, objects, scale_factor, proposals):
+    page_annotations = st.session_state['annotations'].setdefault(page, [])
+    existing = {(a.x, a.y, a.w, a.h) for a in page_annotations}
+    for obj in objects:
+        if obj.get("type") != "circle":
+            continue
+        click_x = (obj["left"] + obj.get("radius", 0)) * scale_factor
+        click_y = (obj["top"] + obj.get("radius", 0)) * scale_factor
+        hits = [box for box in proposals if box[0] <= click_x <= box[0] + box[2] and box[1] <= click_y <= box[1] + box[3]]
+        if hits:
+            box = tuple(min(hits, key=lambda hit: hit[2] * hit[3]))
+            if box not in existing:
+                page_annotations.append(Annotation(page, *box))
+                existing.add(box)
+    return page_annotations
+
+# Function to get the dataset image id of a page
+def get_image_id(file_name, page, is_multipage):
+    if not is_multipage:
+        return file_name
+    return f"{os.path.splitext(file_name)[0]}_page_{page + 1}.png"
+
+# Function to get the label of a metadata field
+def get_field_label(metadata_types, field_id):
+    for meta in metadata_types:
+        if meta['metadata_type']['id'] == field_id:
+            return meta['metadata_type']['label']
+    return "other"
+
+# Function to get the metadata field of a label
+def get_field_id(metadata_types, label):
+    for meta in metadata_types:
+        if meta['metadata_type']['label'] == label:
+            return meta['metadata_type']['id']
+    return None
+
+# Function to get the submitted field of a box: the field it filled, or else the field whose submitted value its OCR text matches
+def match_submitted_field(annotation, metadata_values):
+    if annotation.field_id in metadata_values and str(metadata_values[annotation.field_id]).strip():
+        return annotation.field_id
+    text = " ".join((annotation.text or "").split()).casefold()
+    if not text:
+        return None
+    best_field, best_ratio = None, EXPORT_MATCH_RATIO
+    for field_id, value in metadata_values.items():
+        value = " ".join(str(value or "").split()).casefold()
+        ratio = difflib.SequenceMatcher(None, text, value).ratio() if value else 0.0
+        if ratio >= best_ratio:
+            best_field, best_ratio = field_id, ratio
+    return best_field
+
+# Function to convert the annotations of a page to a record in the docs/json word-box format.
+# Boxes matched to a submitted field take its label and the submitted (operator-corrected) value.
+def annotations_to_record(page_annotations, image_id, image_size, image_ref, metadata_types, metadata_values):
+    words = []
+    for a in page_annotations:
+        field_id = match_submitted_field(a, metadata_values)
+        words.append({
+            "rect": {"x1": a.x, "y1": a.y, "x2": a.x + a.w, "y2": a.y + a.h},
+            "value": str(metadata_values[field_id]) if field_id is not None else a.text or "",
+            "label": get_field_label(metadata_types, field_id),
+        })
+    return {
+        "meta": {
+            "version": "v0.1",
+            "split": "train",
+            "image_id": image_id,
+            "image_size": {"width": image_size[0], "height": image_size[1]},
+            "image_ref": image_ref,
+        },
+        "words": words,
+    }
+
+# Function to get the process-wide lock serializing writes to the export shards
+@st.cache_resource
+def get_export_lock():
+    return threading.Lock()
+
+# Function to get the shard file to append the next export records to
+def get_export_shard():
+    shards = sorted(name for name in os.listdir(EXPORT_DIR) if name.startswith("annotations-") and name.endswith(".jsonl"))
+    if shards:
+        path = os.path.join(EXPORT_DIR, shards[-1])
+        with open(path, 'rb') as f:
+            if sum(1 for _ in f) < EXPORT_SHARD_SIZE:
+                return path
+    return os.path.join(EXPORT_DIR, f"annotations-{len(shards):05d}.jsonl")
+
+# Function to export the annotations of a submitted document, with the source file stored by reference
+def export_annotations(file_bytes, file_name, doc_type_id, is_multipage, metadata_types, metadata_values):
+    page_sizes = st.session_state.get('page_sizes', {})
+    records = []
+    digest = hashlib.sha256(file_bytes).hexdigest()
+    file_ref = os.path.join("files", digest + os.path.splitext(file_name)[1].lower())
+    for page in sorted(st.session_state['annotations']):
+        page_annotations = load_page_annotations(page)
+        if not page_annotations or page not in page_sizes:
+            continue
+        image_ref = {"path": file_ref, "page": page, "doctype_id": doc_type_id}
+        records.append(annotations_to_record(page_annotations, get_image_id(file_name, page, is_multipage), page_sizes[page], image_ref, metadata_types, metadata_values))
+    if not records:
+        return 0
+
     try:
-        doc = fitz.open(stream=uploaded_file.getvalue(), filetype="pdf")
-        total_pages = len(doc)
-        current_page = st.session_state.get('current_page', 0)
+        with get_export_lock():
+            os.makedirs(os.path.join(EXPORT_DIR, "files"), exist_ok=True)
+            file_path = os.path.join(EXPORT_DIR, file_ref)
+            if not os.path.exists(file_path):
+                with open(file_path, 'wb') as f:
+                    f.write(file_bytes)
+            with open(get_export_shard(), 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        st.error(f"Error exporting annotations: {e}")
+        return 0
+    return len(records)
 
-        col_empty_PDF, col1_titlePDF, col2, col3, col4 = st.columns([1, 5, 2, 2, 1])
-        with col1_titlePDF:
-            st.markdown("#### Preview of the PDF:")
-
-        with col2:
-            if st.button('Previous page', key='prev_page'):
-                if current_page > 0:
-                    st.session_state['canvas_reset'] = True  # Flag to reset canvas
-                    current_page -= 1
-                    st.session_state['current_page'] = current_page
-
-        with col3:
-            if st.button('Next page', key='next_page'):
-                if current_page < total_pages - 1:
-                    st.session_state['canvas_reset'] = True  # Flag to reset canvas
-                    current_page += 1
-                    st.session_state['current_page'] = current_page
-
-        page = doc.load_page(current_page)
-        pix = page.get_pixmap(dpi=300)
-        img = Image.open(io.BytesIO(pix.tobytes("png")))
-        img = img.filter(ImageFilter.SHARPEN)
-        images.append(img)
-        original_sizes.append((pix.width, pix.height))
-    except Exception as e:
-        st.error(f"Error in PDF processing: {e}")
-    return images, original_sizes
+# Function to read records in the docs/json word-box format from a JSON or JSONL file
+def load_annotation_records(import_file):
+    content = import_file.getvalue().decode('utf-8')
+    try:
+        data = json.loads(content)
+        return data if isinstance(data, list) else [data]
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+# Function to pre-load imported word boxes as the annotations of the current page.
+# Records are matched on their image id; a lone record with another id is only taken for a single-page document.
+def import_annotations(records, page, image_id, image_size, metadata_types, single_page):
+    matches = [r for r in records if r.get('meta', {}).get('image_id') == image_id]
+    if not matches and single_page and len(records) == 1:
+        matches = records
+    if not matches:
+        return 0
+
+    record = matches[0]
+    size = record.get('meta', {}).get('image_size') or {"width": image_size[0], "height": image_size[1]}
+    scale_x = image_size[0] / size['width']
+    scale_y = image_size[1] / size['height']
+    page_annotations = []
+    for word in record.get('words', []):
+        rect = word['rect']
+        page_annotations.append(Annotation(
+            page,
+            round(rect['x1'] * scale_x),
+            round(rect['y1'] * scale_y),
+            round((rect['x2'] - rect['x1']) * scale_x),
+            round((rect['y2'] - rect['y1']) * scale_y),
+            get_field_id(metadata_types, word.get('label')),
+            word.get('value', ""),
+        ))
+    st.session_state['annotations'][page] = page_annotations
+    return len(page_annotations)
+
+# Function to get the process-wide memory registry shared by all sessions
+@st.cache_resource
+def get_memory_registry():
+    return {"lock": threading.Lock(), "sessions": {}}
+
+# Function to get the id of the current session
+def get_session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else "local"
+
+# Function to estimate the memory footprint of a cached object
+def estimate_size(obj):
+    if obj is None:
+        return 0
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, Image.Image):
+        return obj.width * obj.height * len(obj.getbands())
+    if isinstance(obj, Annotation):
+        return sys.getsizeof(obj) + estimate_size(obj.text)
+    if isinstance(obj, (bytes, bytearray, str)):
+        return len(obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(estimate_size(k) + estimate_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(estimate_size(item) for item in obj)
+    return sys.getsizeof(obj)
+
+# Function to record the size of a cached object for the current session.
+# Objects from the shared render cache (shared=True) count towards the session but are counted once, by the cache, in the global total.
+def track_memory(category, obj, shared=False):
+    st.session_state.setdefault('shared_memory' if shared else 'memory_usage', {})[category] = estimate_size(obj)
+    return obj
+
+# Function to get the spill file of a page
+def get_spill_path(page, session_id=None):
+    document_id = hashlib.md5(st.session_state.get('current_document', '').encode('utf-8')).hexdigest()[:12]
+    return os.path.join(SPILL_DIR, f"{session_id or get_session_id()}_{document_id}_{page}.json")
+
+# Function to check whether the annotations of a page were spilled to disk
+def is_spilled(page_annotations):
+    return isinstance(page_annotations, dict) and 'spilled' in page_annotations
+
+# Function to move the annotations of a page to disk
+def spill_page_annotations(page):
+    page_annotations = st.session_state['annotations'].get(page)
+    if not page_annotations or is_spilled(page_annotations):
+        return 0
+    path = get_spill_path(page)
+    try:
+        remove_expired_spill_files()
+        os.makedirs(SPILL_DIR, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump([annotation.to_list() for annotation in page_annotations], f)
+    except OSError as e:
+        print(f"Error spilling annotations of page {page}: {e}")
+        return 0
+    st.session_state['annotations'][page] = {'spilled': path}
+    return estimate_size(page_annotations)
+
+# Function to load the annotations of a page, reading them back from disk if they were spilled
+def load_page_annotations(page):
+    page_annotations = st.session_state['annotations'].get(page, [])
+    if is_spilled(page_annotations):
+        path = page_annotations['spilled']
+        try:
+            with open(path) as f:
+                page_annotations = [Annotation.from_list(item) for item in json.load(f)]
+            os.remove(path)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Error loading spilled annotations of page {page}: {e}")
+            st.warning(f"The boxes of page {page + 1} could not be restored from disk: {e}")
+            page_annotations = []
+        st.session_state['annotations'][page] = page_annotations
+    return page_annotations
+
+# Function to remove spill files untouched for longer than SPILL_RETENTION, scanning at most once per SPILL_CLEANUP_INTERVAL.
+# Idle sessions keep theirs: an operator returning to an open tab gets the spilled boxes back.
+def remove_expired_spill_files():
+    registry = get_memory_registry()
+    now = time.time()
+    with registry['lock']:
+        if now - registry.get('spill_cleanup', 0) < SPILL_CLEANUP_INTERVAL:
+            return
+        registry['spill_cleanup'] = now
+    if not os.path.isdir(SPILL_DIR):
+        return
+    for name in os.listdir(SPILL_DIR):
+        path = os.path.join(SPILL_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > SPILL_RETENTION:
+                os.remove(path)
+        except OSError:
+            pass
 
+# Function to publish the session usage to the registry and return (session total, global total).
+# The global total counts the shared render cache once, however many sessions show its pages.
+def update_memory_registry():
+    own_bytes = sum(st.session_state.get('memory_usage', {}).values())
+    session_total = own_bytes + sum(st.session_state.get('shared_memory', {}).values())
+    registry = get_memory_registry()
+    render_cache = get_render_cache()
+    now = time.time()
+    with registry['lock']:
+        sessions = registry['sessions']
+        for session_id in [sid for sid, entry in sessions.items() if now - entry['updated'] > SESSION_IDLE_TIMEOUT]:
+            del sessions[session_id]
+        sessions[get_session_id()] = {'bytes': session_total, 'own_bytes': own_bytes, 'updated': now}
+        global_total = sum(entry['own_bytes'] for entry in sessions.values())
+    with render_cache['lock']:
+        global_total += render_cache['bytes']
+    return session_total, global_total
 
+# Function to enforce the memory limits: spill the annotations of cold pages to disk and,
+# when all sessions together are still over the limit, evict least recently used pages of the shared render cache
+def enforce_memory_limits():
+    usage = st.session_state.setdefault('memory_usage', {})
+    annotations = st.session_state['annotations']
+    usage['annotations'] = estimate_size(annotations)
+    session_total, global_total = update_memory_registry()
+
+    if session_total > SESSION_MEMORY_LIMIT or global_total > GLOBAL_MEMORY_LIMIT:
+        current_page = st.session_state.get('current_page', 0)
+        for page in list(annotations):
+            if page != current_page:
+                spill_page_annotations(page)
+        usage['annotations'] = estimate_size(annotations)
+        session_total, global_total = update_memory_registry()
+    if global_total > GLOBAL_MEMORY_LIMIT:
+        evict_render_cache(global_total - GLOBAL_MEMORY_LIMIT)
+        session_total, global_total = update_memory_registry()
+    return session_total, global_total
+
+# Function to display the memory usage report
+def display_memory_usage(session_total, global_total):
+    with st.sidebar.expander("Memory usage"):
+        for category, size in st.session_state.get('memory_usage', {}).items():
+            st.caption(f"{category}: {size / 1024 / 1024:.1f} MB")
+        for category, size in st.session_state.get('shared_memory', {}).items():
+            st.caption(f"{category} (shared): {size / 1024 / 1024:.1f} MB")
+        spilled_pages = sum(1 for page_annotations in st.session_state['annotations'].values() if is_spilled(page_annotations))
+        st.caption(f"Spilled pages: {spilled_pages}")
+        st.markdown(f"**Session:** {session_total / 1024 / 1024:.1f} / {SESSION_MEMORY_LIMIT / 1024 / 1024:.0f} MB")
+        st.progress(min(session_total / SESSION_MEMORY_LIMIT, 1.0))
+        st.markdown(f"**All sessions:** {global_total / 1024 / 1024:.1f} / {GLOBAL_MEMORY_LIMIT / 1024 / 1024:.0f} MB")
+        st.progress(min(global_total / GLOBAL_MEMORY_LIMIT, 1.0))
+
+# Function to compile a validation pattern once
+@functools.lru_cache(maxsize=256)
+def compile_pattern(pattern):
+    return re.compile(pattern)
 
 # Function to validate input
 def validate_input(input_value, pattern):
-    if pattern and not re.match(pattern, input_value):
+    if pattern and not compile_pattern(pattern).match(input_value):
         return False
     return True
 
 # Function to load JSON safely
+@functools.lru_cache(maxsize=256)
 def safe_load_json(validation_arguments):
     try:
         valid_json = validation_arguments.replace("'", '"')
@@ -116,50 +987,292 @@ def safe_load_json(validation_arguments):
         print(f"Missing key in JSON data: {e}")
         return ""
 
-# Function to save data to JSON
-def save_to_json(file_base64, file_name, doc_type_id, metadata_values):
+# Function to build the submission fields other than the file
+def get_submission_metadata(file_name, doc_type_id, metadata_values):
     metadata_list = [{"id": id, "value": value} for id, value in metadata_values.items()]
-    data = {
-        "file_base64": file_base64,
+    return {
         "dms_domain": "edms-demo.epik.live",
         "file_name": file_name,
         "doctype_id": doc_type_id,
         "docmeta_data": metadata_list,
     }
+
+# Function to save data to JSON
+def save_to_json(file_base64, file_name, doc_type_id, metadata_values):
+    data = {"file_base64": file_base64, **get_submission_metadata(file_name, doc_type_id, metadata_values)}
     with open('data.json', 'w') as json_file:
         json.dump(data, json_file)
 
-# Function to save and download data as JSON
-def save_and_download_json(file_base64, file_name, doc_type_id, metadata_values):
+# Function to save and download data as JSON, then submit it.
+# In chunked mode the raw file is streamed as is: there is no base64 JSON body to build or download.
+def save_and_download_json(file_bytes, file_name, doc_type_id, metadata_values):
     progress_text = st.markdown(" ***Please wait a moment for the data submission process.***")
     progress_bar = st.progress(0)
-    save_to_json(file_base64, file_name, doc_type_id, metadata_values)
-    
-    progress_bar.progress(40)
-    with open('data.json', 'rb') as f:
-        data = f.read()
-    progress_bar.progress(75)
-    st.download_button(label="Download JSON", data=data, file_name="data.json", mime="application/json")
-    json_data = json.loads(data)
-    
-    response = send_data_to_api(json_data)
+    if UPLOAD_MODE == "chunked":
+        metadata = get_submission_metadata(file_name, doc_type_id, metadata_values)
+        send = lambda: send_data_chunked(file_bytes, metadata, progress=lambda fraction: progress_bar.progress(int(99 * fraction)))
+    else:
+        save_to_json(base64.b64encode(file_bytes).decode('utf-8'), file_name, doc_type_id, metadata_values)
+
+        progress_bar.progress(40)
+        with open('data.json', 'rb') as f:
+            data = f.read()
+        progress_bar.progress(75)
+        st.download_button(label="Download JSON", data=data, file_name="data.json", mime="application/json")
+        json_data = json.loads(data)
+        send = lambda: send_data_to_api(json_data)
+
+    metrics = get_metrics()
+    try:
+        with metrics["submission_seconds"].time():
+            response = send()
+    except lazy_import("requests").RequestException as e:
+        metrics["submission_failures_total"].inc(status="error")
+        st.error(f"Failed to send data to the API: {e}")
+        progress_bar.progress(0)
+        return False
     if response.status_code == 200:
         progress_bar.progress(100)
         progress_text.markdown(" :green[Data submission completed successfully!]")
+        return True
     else:
+        metrics["submission_failures_total"].inc(status=response.status_code)
         st.error(f"Failed to send data to the API: {response.status_code}")
         progress_bar.progress(0)
+        return False
 
 # Function to send data to API
 def send_data_to_api(json_data):
-    url = "https://dms.api.epik.live/api/processBase64File"
+    url = f"{DMS_API_URL}/processBase64File"
     headers = {'Content-Type': 'application/json'}
-    response = requests.post(url, json=json_data, headers=headers)
+    response = get_http_session().post(url, json=json_data, headers=headers, timeout=UPLOAD_TIMEOUT)
     return response
 
+# Function to send the file in checksummed chunks, resuming from the last offset acknowledged by the server.
+# Protocol: POST .../uploads {file_name, size, sha256} -> {upload_id, offset} (an unfinished upload of the
+# same file is resumed), PUT .../uploads/<id> with Content-Range and X-Chunk-SHA256 -> {offset},
+# GET .../uploads/<id> -> {offset}, then POST .../uploads/<id>/complete with the metadata.
+def send_data_chunked(file_bytes, metadata, progress=None):
+    requests = lazy_import("requests")
+    session = get_http_session()
+    total = len(file_bytes)
+    uploads_url = f"{DMS_API_URL}/processBase64File/uploads"
+
+    response = session.post(uploads_url, json={
+        "file_name": metadata['file_name'],
+        "size": total,
+        "sha256": hashlib.sha256(file_bytes).hexdigest(),
+    }, timeout=UPLOAD_TIMEOUT)
+    if response.status_code not in (200, 201):
+        return response
+    upload = response.json()
+    upload_url = f"{uploads_url}/{upload['upload_id']}"
+    offset = upload.get('offset', 0)
+
+    failures = 0
+    while offset < total:
+        chunk = file_bytes[offset:offset + UPLOAD_CHUNK_SIZE]
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'Content-Range': f"bytes {offset}-{offset + len(chunk) - 1}/{total}",
+            'X-Chunk-SHA256': hashlib.sha256(chunk).hexdigest(),
+        }
+        try:
+            response = session.put(upload_url, data=chunk, headers=headers, timeout=UPLOAD_TIMEOUT)
+            if response.status_code in (200, 409):
+                # 409 means the server holds a different offset; continue from the one it acknowledged.
+                # An answer that does not move the offset counts as a failed attempt, with backoff.
+                acknowledged = response.json()['offset']
+                if acknowledged != offset:
+                    offset = acknowledged
+                    failures = 0
+                    if progress:
+                        progress(offset / total)
+                    continue
+        except requests.RequestException:
+            if failures >= UPLOAD_MAX_RETRIES:
+                raise
+        if failures >= UPLOAD_MAX_RETRIES:
+            if response.status_code in (200, 409):
+                raise requests.RequestException(f"The server did not advance the upload past offset {offset}")
+            return response
+        failures += 1
+        time.sleep(min(2 ** failures, 30))
+        try:
+            offset = session.get(upload_url, timeout=UPLOAD_TIMEOUT).json()['offset']
+        except (requests.RequestException, ValueError, KeyError):
+            pass
+
+    return session.post(f"{upload_url}/complete", json=metadata, timeout=UPLOAD_TIMEOUT)
+
+# Function to get the payload optimization settings of a document type
+def get_payload_optimization(doc_type_id):
+    options = dict(DEFAULT_PAYLOAD_OPTIMIZATION)
+    try:
+        with open(PAYLOAD_OPTIMIZATION_CONFIG) as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return options
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Error loading payload optimization config: {e}")
+        return options
+    options.update(config.get("default", {}))
+    options.update(config.get(str(doc_type_id), {}))
+    return options
+
+# Function to recompress a PDF with PyMuPDF's garbage collection and stream deflation
+def optimize_pdf(file_bytes):
+    with lazy_import("fitz").open(stream=file_bytes, filetype="pdf") as doc:
+        return doc.tobytes(garbage=4, deflate=True, clean=True)
+
+# Function to downscale and re-encode an image, returning the new bytes and file extension
+def optimize_image(file_bytes, options):
+    img = Image.open(io.BytesIO(file_bytes))
+    image_format = img.format
+    if getattr(img, "n_frames", 1) > 1:
+        # Multi-page TIFFs are only recompressed losslessly
+        output = io.BytesIO()
+        img.save(output, format='TIFF', save_all=True, compression='tiff_adobe_deflate')
+        return output.getvalue(), ".tiff"
+
+    # Orientation and colour profile are carried over; phone photos would otherwise reach the DMS rotated.
+    # Only the Orientation tag is kept: a TIFF's IFD0 (image size, strips) would describe the wrong image.
+    orientation = img.getexif().get(EXIF_ORIENTATION)
+    source_mode = img.mode
+    icc_profile = img.info.get('icc_profile')
+    dpi = img.info.get('dpi', (0, 0))[0]
+    max_dpi = options.get("max_dpi")
+    resized = False
+    if max_dpi and dpi and dpi > max_dpi:
+        scale = max_dpi / dpi
+        img = img.resize((round(img.width * scale), round(img.height * scale)), Image.Resampling.LANCZOS)
+        dpi = max_dpi
+        resized = True
+    exif = None
+    if orientation:
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION] = orientation
+
+    output = io.BytesIO()
+
+    # Function to save the output image; the colour profile is only valid when the mode did not change (e.g. not for CMYK to RGB)
+    def save(output_img, **save_options):
+        if dpi:
+            save_options["dpi"] = (dpi, dpi)
+        if exif is not None and save_options["format"] != 'TIFF':
+            save_options["exif"] = exif.tobytes()
+        if icc_profile and output_img.mode == source_mode:
+            save_options["icc_profile"] = icc_profile
+        output_img.save(output, **save_options)
+        return output.getvalue()
+
+    if options.get("webp_quality"):
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGB')
+        return save(img, format='WEBP', quality=options["webp_quality"]), ".webp"
+    if image_format == 'JPEG':
+        if not options.get("jpeg_quality") and not resized:
+            # Keep the original encoding
+            return file_bytes, None
+        quality = options.get("jpeg_quality") or 95
+        return save(img.convert('RGB'), format='JPEG', quality=quality, optimize=True), ".jpg"
+    if image_format == 'PNG':
+        return save(img, format='PNG', optimize=options.get("png_optimize", True)), ".png"
+    if image_format == 'TIFF':
+        return save(img, format='TIFF', compression='tiff_adobe_deflate'), ".tiff"
+    return file_bytes, None
+
+# Function to check that an optimized file still decodes, with the expected number of pages
+def payload_decodes(file_bytes, file_kind, page_count):
+    try:
+        if file_kind == "pdf":
+            with lazy_import("fitz").open(stream=file_bytes, filetype="pdf") as doc:
+                return len(doc) == page_count
+        with Image.open(io.BytesIO(file_bytes)) as img:
+            frames = getattr(img, "n_frames", 1)
+            for frame in range(frames):
+                img.seek(frame)
+                img.load()
+        return frames == page_count
+    except Exception as e:
+        print(f"Optimized payload does not decode: {e}")
+        return False
+
+# Function to shrink the file before submission; the original is kept when nothing is saved
+def optimize_payload(file_bytes, file_name, file_kind, options):
+    if not options.get("enabled"):
+        return file_bytes, file_name
+    try:
+        if file_kind == "pdf":
+            if not options.get("pdf_recompress"):
+                return file_bytes, file_name
+            optimized, extension = optimize_pdf(file_bytes), None
+        else:
+            optimized, extension = optimize_image(file_bytes, options)
+    except Exception as e:
+        print(f"Error optimizing payload of {file_name}: {e}")
+        return file_bytes, file_name
+    if len(optimized) >= len(file_bytes):
+        return file_bytes, file_name
+    # A smaller file is only worth sending if the DMS can still read it
+    if not payload_decodes(optimized, file_kind, get_page_count(file_bytes, file_kind)):
+        return file_bytes, file_name
+    if extension and not file_name.lower().endswith(extension):
+        file_name = os.path.splitext(file_name)[0] + extension
+    return optimized, file_name
+
+# Function to get the duplicate index shared by all sessions
+@st.cache_resource(show_spinner=False)
+def get_duplicate_index():
+    return DuplicateIndex(DUPLICATE_INDEX_PATH, DUPLICATE_MAX_DISTANCE, DUPLICATE_MIN_TEXT_SIMILARITY)
+
+# Function to get the duplicate lookup keys of a document: the perceptual hash of its cached thumbnail, its page count,
+# its content hash and the content tokens of its first page (from the pre-OCR words, empty when OCR is unavailable)
+def get_document_fingerprint(uploaded_file):
+    file_bytes = uploaded_file.getvalue()
+    file_kind = get_file_kind(uploaded_file)
+    content_hash = get_content_hash(file_bytes)
+    try:
+        img, original_size = render_page(file_bytes, file_kind, 0)
+        tokens = content_tokens(word[4] for word in get_page_words(img, cache_key=(content_hash, 0)))
+    except Exception as e:
+        print(f"Error reading the first page of {uploaded_file.name} for duplicate detection: {e}")
+        tokens = []
+    return dhash(get_thumbnail(file_bytes, file_kind)), get_page_count(file_bytes, file_kind), content_hash, tokens
+
+# Function to find previously submitted copies of a document, checked once per file
+def find_duplicates(uploaded_file):
+    if DUPLICATE_POLICY == "off":
+        return []
+    file_key = uploaded_file.name + str(uploaded_file.size)
+    checked = st.session_state.setdefault('duplicate_checks', {})
+    if file_key not in checked:
+        try:
+            checked[file_key] = get_duplicate_index().find(*get_document_fingerprint(uploaded_file))
+        except Exception as e:
+            print(f"Error checking duplicates of {uploaded_file.name}: {e}")
+            checked[file_key] = []
+    return checked[file_key]
+
+# Function to add a submitted document to the duplicate index
+def record_submission(uploaded_file, doc_type_id):
+    if DUPLICATE_POLICY == "off":
+        return
+    try:
+        value, page_count, content_hash, tokens = get_document_fingerprint(uploaded_file)
+        get_duplicate_index().add(value, page_count, uploaded_file.name, doc_type_id, content_hash, tokens)
+    except Exception as e:
+        print(f"Error indexing {uploaded_file.name}: {e}")
+    st.session_state.get('duplicate_checks', {}).pop(uploaded_file.name + str(uploaded_file.size), None)
+
 # Function to handle submission
 def handle_submission(uploaded_file, doc_type_id, metadata_values):
-    metadata_types = get_metadata_types(doc_type_id)
+    try:
+        metadata_types = get_metadata_types(doc_type_id)
+    except lazy_import("requests").RequestException as e:
+        # Without the field definitions the required-field and pattern checks cannot run
+        st.error(f"Failed to load the metadata fields, nothing was submitted: {e}")
+        return False
     valid = True
     error_messages = []
 
@@ -184,177 +1297,273 @@ def handle_submission(uploaded_file, doc_type_id, metadata_values):
             st.error(msg)
     
     if valid:
-        file_base64 = base64.b64encode(uploaded_file.getvalue()).decode('utf-8')
-        file_name = uploaded_file.name
-        save_and_download_json(file_base64, file_name, doc_type_id, metadata_values)
+        file_bytes, file_name = optimize_payload(uploaded_file.getvalue(), uploaded_file.name, get_file_kind(uploaded_file), get_payload_optimization(doc_type_id))
+        saved = uploaded_file.size - len(file_bytes)
+        if saved > 0:
+            st.caption(f"Payload optimized: {uploaded_file.size / 1024:.0f} KB → {len(file_bytes) / 1024:.0f} KB ({saved / uploaded_file.size:.0%} saved)")
+        submitted = save_and_download_json(file_bytes, file_name, doc_type_id, metadata_values)
+        if submitted:
+            record_submission(uploaded_file, doc_type_id)
+            exported = export_annotations(uploaded_file.getvalue(), uploaded_file.name, doc_type_id, get_file_kind(uploaded_file) != "image", metadata_types, metadata_values)
+            if exported:
+                st.caption(f"Exported annotations of {exported} page(s) to {EXPORT_DIR}")
         st.success("Data saved and submitted successfully!")
+        return submitted
+    return False
+
+# Function to display the canvas of the current page and OCR newly drawn boxes
+@st.fragment
+def annotation_canvas(uploaded_file, file_kind, doc_type_id, import_file):
+    file_bytes = uploaded_file.getvalue()
+    file_key = uploaded_file.name + str(uploaded_file.size)
+    current_page = st.session_state.get('current_page', 0)
+    get_metrics()["render_requests_total"].inc(kind=file_kind)
+    try:
+        img, original_size = render_page(file_bytes, file_kind, current_page)
+        img_resized, scale_factor, img_bytes = get_display_image(file_bytes, file_kind, current_page)
+    except Exception as e:
+        st.error(f"Error in document processing: {e}")
+        return
+    track_memory('page_image', img, shared=True)
+    track_memory('img_resized', img_resized, shared=True)
+    track_memory('download_png', img_bytes, shared=True)
+    st.session_state.setdefault('page_sizes', {})[current_page] = original_size
+
+    try:
+        metadata_types = get_metadata_types(doc_type_id)
+    except lazy_import("requests").RequestException:
+        # The metadata form reports the error; boxes can still be drawn and copied
+        metadata_types = []
+    text_fields = {meta['metadata_type']['id']: meta['metadata_type']['label'] for meta in metadata_types if not meta['metadata_type'].get('lookup')}
+    target_field = st.selectbox(
+        "Fill field from box:", [None] + list(text_fields),
+        format_func=lambda field_id: "(copy to clipboard only)" if field_id is None else text_fields[field_id],
+        key="target_field"
+    )
+
+    proposal_mode = st.checkbox("Click to select proposed text blocks", key="proposal_mode")
+    proposals = get_layout_proposals(file_bytes, file_kind, current_page) if proposal_mode else []
+
+    # Create a placeholder for the success message
+    success_placeholder = st.empty()
+
+    # Pre-load imported annotations once per import file and page
+    if import_file:
+        import_key = (import_file.name, import_file.size, file_key, current_page)
+        imported = st.session_state.setdefault('imported_annotations', set())
+        if import_key not in imported:
+            imported.add(import_key)
+            try:
+                records = load_annotation_records(import_file)
+                single_page = get_page_count(file_bytes, file_kind) == 1
+                count = import_annotations(records, current_page, get_image_id(uploaded_file.name, current_page, file_kind != "image"), original_size, metadata_types, single_page)
+                # The canvas still reports the drawing from before the import; rebuild it from the imported boxes
+                st.session_state['canvas_reset'] = True
+                st.success(f"Imported {count} annotation(s) for this page")
+            except (UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError, ZeroDivisionError) as e:
+                st.error(f"Error importing annotations: {e}")
+
+    # Load the annotations of the current page and rebuild the canvas drawing from them
+    page_annotations = load_page_annotations(current_page)
+    if st.session_state.get('canvas_reset', False) and not page_annotations and not proposals:
+        initial_drawing = None
+    else:
+        initial_drawing = annotations_to_canvas_json(page_annotations, scale_factor, proposals)
+
+    canvas_result = lazy_import("streamlit_drawable_canvas").st_canvas(
+        fill_color=CANVAS_FILL_COLOR,  # Rectangle color
+        stroke_width=CANVAS_STROKE_WIDTH,
+        stroke_color=CANVAS_STROKE_COLOR,
+        background_image=img_resized,
+        update_streamlit=True,
+        height=img_resized.height,
+        width=img_resized.width,
+        drawing_mode="point" if proposal_mode else "rect",
+        point_display_radius=3,
+        key="canvas",
+        initial_drawing=initial_drawing,
+    )
+
+    # Reset the canvas reset flag
+    canvas_reset = st.session_state.get('canvas_reset', False)
+    if canvas_reset:
+        st.session_state['canvas_reset'] = False
+
+    # An empty object list is synced too: the operator cleared the canvas or undid every box.
+    # Right after a reset the drawing was just rebuilt from the stored annotations, and the canvas may still report the previous page.
+    if canvas_result.json_data is not None and not canvas_reset:
+        page_annotations = sync_annotations(current_page, canvas_result.json_data["objects"], scale_factor)
+        if proposal_mode:
+            page_annotations = snap_clicks_to_proposals(current_page, canvas_result.json_data["objects"], scale_factor, proposals)
+
+        # Only newly drawn or resized boxes need OCR
+        new_annotations = [annotation for annotation in page_annotations if annotation.text is None]
+        preprocessed = get_preprocessed(file_key)
+        page_words = preprocessed['words'].get(current_page) if preprocessed else None
+        content_hash = get_content_hash(file_bytes) if new_annotations else None
+        for annotation in new_annotations:
+            rect = {"left": annotation.x, "top": annotation.y, "width": annotation.w, "height": annotation.h}
+            # The page was pre-OCRed in the background; fall back to OCR of the region when no words fall inside it
+            annotation.text = (words_in_rect(page_words, rect) if page_words else "") or perform_ocr(img, rect, cache_key=(content_hash, current_page))
+            annotation.field_id = target_field
+
+        if page_annotations:
+            text = page_annotations[-1].text
+
+            # Copy extracted text to clipboard
+            lazy_import("pyperclip").copy(text)
+            # Display success message above the metadata inputs
+            success_placeholder.success(f"Extracted text copied to clipboard: {text}")
+
+        # Fill the target field; the form lives in its own fragment, so it needs a rerun to show the value
+        if new_annotations and target_field is not None:
+            st.session_state[f"meta_{target_field}_{uploaded_file.name}"] = new_annotations[-1].text
+            st.rerun()
+
+    st.download_button(
+        label="Download Image",
+        data=img_bytes,
+        file_name="extracted_image.png",
+        mime="image/png"
+    )
+
+# Function to display the metadata form and submit the document
+@st.fragment
+def metadata_form(uploaded_file, doc_type_id):
+    try:
+        metadata_types = get_metadata_types(doc_type_id)
+    except lazy_import("requests").RequestException as e:
+        st.error(f"Failed to load the metadata fields: {e}")
+        return
+    metadata_values = {}
+
+    for meta in metadata_types:
+        metadata_info = meta['metadata_type']
+        label = metadata_info['label']
+        required = meta.get('required', False)
+        input_key = f"meta_{metadata_info['id']}_{uploaded_file.name}"
+        validation = metadata_info.get('validation', '')
+        validation_arguments = metadata_info.get('validation_arguments', '')
+        pattern = safe_load_json(validation_arguments) if 'RegularExpressionValidator' in validation and validation_arguments else ""
+
+        if metadata_info.get('lookup'):
+            options = metadata_info['lookup'].split(',')
+            selected_option = st.selectbox(
+                f"{label}{' *' if required else ''}", options, key=input_key
+            )
+            metadata_values[metadata_info['id']] = selected_option
+        else:
+            if input_key not in st.session_state:
+                st.session_state[input_key] = ""
+            user_input = st.text_input(
+                f"{label}{' *' if required else ''}",
+                key=input_key
+            )
+            error_placeholder = st.empty()
+            metadata_values[metadata_info['id']] = user_input
+
+            if user_input and pattern and not validate_input(user_input, pattern):
+                error_placeholder.error(f"Invalid input for {label}. Please match the required format.")
+
+    # Warn about duplicates (or refuse exact re-uploads) before the payload is built
+    duplicates = find_duplicates(uploaded_file)
+    allow_submit = True
+    if duplicates:
+        match = duplicates[0]
+        submitted_at = time.strftime('%Y-%m-%d %H:%M', time.localtime(match['submitted_at']))
+        if match['kind'] == "exact":
+            st.warning(f"This file was already submitted as '{match['file_name']}' on {submitted_at}.")
+        else:
+            st.warning(f"This document looks like '{match['file_name']}', submitted on {submitted_at}.")
+        if DUPLICATE_POLICY == "skip" and match['kind'] == "exact":
+            allow_submit = False
+        else:
+            allow_submit = st.checkbox("Submit anyway", key=f"submit_duplicate_{uploaded_file.name}")
+
+    if st.button("Done and Submit", type="primary", disabled=not allow_submit):
+        if handle_submission(uploaded_file, doc_type_id, metadata_values):
+            file_key = uploaded_file.name + str(uploaded_file.size)
+            st.session_state['upload_queue'][file_key]['submitted'] = True
 
 def main():
+    run_started = SCRIPT_STARTED
+    prewarm_state = start_prewarm()
+
     st.markdown("""<style>
         .reportview-container .main .block-container
         {max-width: 90%;}
         </style>""", unsafe_allow_html=True)
 
-    if 'canvas_state' not in st.session_state:
-        st.session_state['canvas_state'] = {}
+    if 'annotations' not in st.session_state:
+        st.session_state['annotations'] = {}
 
     if 'current_page' not in st.session_state:
         st.session_state['current_page'] = 0
 
-    document_types = get_document_types()
-    doc_type_options = {doc['label']: doc['id'] for doc in document_types}
+    # Usage is re-measured on every run
+    st.session_state['memory_usage'] = {}
+    st.session_state['shared_memory'] = {}
 
     col_title1, col_title2 = st.columns([1, 8])
     with col_title2:
         st.title('Document Viewer App')
 
+    # The catalog is fetched by the prewarm thread; the title is already painted while waiting for it
+    if not prewarm_state['events']['doctype_catalog'].is_set():
+        with st.spinner("Loading document types..."):
+            prewarm_state['events']['doctype_catalog'].wait(PREWARM_WAIT_TIMEOUT)
+    try:
+        document_types = get_document_types()
+    except lazy_import("requests").RequestException as e:
+        st.error(f"Failed to load document types: {e}")
+        st.stop()
+    doc_type_options = {doc['label']: doc['id'] for doc in document_types}
+
     col_empty_1, col_select, col_upload, col_empty_4 = st.columns([1, 4, 4, 1])
     with col_select:
         doc_type = st.selectbox("Choose the document type:", list(doc_type_options.keys()), key='doc_type')
     with col_upload:
-        uploaded_file = st.file_uploader("Upload your document", type=['png', 'jpg', 'jpeg', 'pdf'], key="uploaded_file")
+        uploaded_files = st.file_uploader("Upload your documents", type=['png', 'jpg', 'jpeg', 'pdf', 'tif', 'tiff'], key="uploaded_file", accept_multiple_files=True)
 
-    if uploaded_file:
-        file_key = uploaded_file.name + str(uploaded_file.size)
+    # Queued documents are preprocessed in the background while the current one is annotated
+    queue = update_upload_queue(uploaded_files)
+    uploaded_file = None
+    if queue:
+        with st.sidebar:
+            st.markdown("#### Document queue")
+            file_key = st.radio(
+                "Current document:", list(queue),
+                format_func=lambda key: queue[key]['file'].name,
+                key="queue_selection"
+            )
+            # Polling stops once every document is ready, failed or submitted
+            if has_pending_uploads():
+                poll_upload_queue()
+            else:
+                display_upload_queue()
+        switch_document(file_key)
+        uploaded_file = queue[file_key]['file']
+
+    import_file = st.sidebar.file_uploader("Import annotations (docs/json format)", type=['json', 'jsonl'], key="import_file")
 
     col1, col2_emt, col3_input_filed = st.columns([6.5, 0.1, 3.4])
-    with col1:
-        if uploaded_file:
-            images = []
-            original_sizes = []
-            is_pdf = False
-
-            if uploaded_file.type == "application/pdf":
-                images, original_sizes = display_pdf_and_convert_to_image(uploaded_file)
-                is_pdf = True
-            else:
-                img = load_image(uploaded_file)
-                images.append(img)
-                original_sizes.append(img.size)
-
-            for img, original_size in zip(images, original_sizes):
-                img_cv = np.array(img.convert('RGB'))
-
-                if is_pdf:
-                    # Scale down the image by a factor of 3 if it's a PDF
-                    scale_factor = 3
-                    new_width = original_size[0] // scale_factor
-                    new_height = original_size[1] // scale_factor
-                    img_resized = img.resize((new_width, new_height))
-                else:
-                    # Fit the image within a specific area (max width 800, max height 600)
-                    max_width = 1500
-                    max_height = 1500
-                    img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
-                    img_resized = img
-                    new_width, new_height = img_resized.size
-                    scale_factor = original_size[0] / new_width 
-
-                if 'inputs' not in st.session_state:
-                    st.session_state.inputs = {}
-
-                if 'new_rect' not in st.session_state:
-                    st.session_state.new_rect = False
-
-                if 'fill_data' not in st.session_state:
-                    st.session_state.fill_data = False
-
-                metadata_types = get_metadata_types(doc_type_options[doc_type])
-                metadata_values = {}
-                error_placeholders = {}
-
-                # Create a placeholder for the success message
-                success_placeholder = st.empty()
-
-                # Load the canvas state if it exists for the current page
-                canvas_state = st.session_state['canvas_state'].get(st.session_state.get('current_page', 0), {})
-
-                canvas_result = st_canvas(
-                    fill_color="rgba(255, 0, 0, 0.3)",  # Rectangle color
-                    stroke_width=2,
-                    stroke_color="rgba(255, 0, 0, 1)",
-                    background_image=Image.fromarray(np.array(img_resized)),
-                    update_streamlit=True,
-                    height=new_height,
-                    width=new_width,
-                    drawing_mode="rect",
-                    key="canvas",
-                    initial_drawing=None if st.session_state.get('canvas_reset', False) else canvas_state.get('initial_drawing', {}),
-                )
-
-                # Reset the canvas reset flag
-                if st.session_state.get('canvas_reset', False):
-                    st.session_state['canvas_reset'] = False
-
-                if 'interaction_processed' not in st.session_state:
-                    st.session_state.interaction_processed = False
-
-                if canvas_result.json_data is not None:
-                    objects = canvas_result.json_data["objects"]
-                    if objects:
-                        obj = objects[-1]
-                        left = int(obj["left"] * scale_factor)
-                        top = int(obj["top"] * scale_factor)
-                        width = int(obj["width"] * scale_factor)
-                        height = int(obj["height"] * scale_factor)
-
-                        roi = img_cv[top:top + height, left:left + width]
-                        text = pytesseract.image_to_string(roi, lang='eng').strip()
-
-                        # Copy extracted text to clipboard
-                        pyperclip.copy(text)
-                        # Display success message above the metadata inputs
-                        success_placeholder.success(f"Extracted text copied to clipboard: {text}")
-
-                        # Store the updated canvas state
-                        st.session_state['canvas_state'][st.session_state['current_page']] = canvas_result.json_data
-
-                # Add a download button for the image
-                img_bytes = io.BytesIO()
-                img_resized.save(img_bytes, format='PNG')
-                img_bytes = img_bytes.getvalue()
-
-                st.download_button(
-                    label="Download Image",
-                    data=img_bytes,
-                    file_name="extracted_image.png",
-                    mime="image/png"
-                )
-
-                with col3_input_filed:
-                    for meta in metadata_types:
-                        metadata_info = meta['metadata_type']
-                        label = metadata_info['label']
-                        required = meta.get('required', False)
-                        input_key = f"meta_{metadata_info['id']}_{uploaded_file.name}"
-                        validation = metadata_info.get('validation', '')
-                        validation_arguments = metadata_info.get('validation_arguments', '')
-                        pattern = safe_load_json(validation_arguments) if 'RegularExpressionValidator' in validation and validation_arguments else ""
-
-                        if metadata_info.get('lookup'):
-                            options = metadata_info['lookup'].split(',')
-                            selected_option = st.selectbox(
-                                f"{label}{' *' if required else ''}", options, key=input_key
-                            )
-                            metadata_values[metadata_info['id']] = selected_option
-                        else:
-                            if input_key not in st.session_state.inputs:
-                                st.session_state.inputs[input_key] = ""
-                            user_input = st.text_input(
-                                f"{label}{' *' if required else ''}",
-                                st.session_state.inputs[input_key],
-                                key=input_key
-                            )
-                            error_placeholders[metadata_info['id']] = st.empty()
-                            metadata_values[metadata_info['id']] = user_input
-
-                            if user_input and pattern and not validate_input(user_input, pattern):
-                                error_placeholders[metadata_info['id']].error(f"Invalid input for {label}. Please match the required format.")
-                            else:
-                                error_placeholders[metadata_info['id']].empty()
-
-                    if st.button("Done and Submit", type="primary"):
-                        handle_submission(uploaded_file, doc_type_options[doc_type], metadata_values)
+    if uploaded_file and doc_type:
+        file_kind = get_file_kind(uploaded_file)
+        with col1:
+            if file_kind != "image":
+                try:
+                    total_pages = get_page_count(uploaded_file.getvalue(), file_kind)
+                    if file_kind == "pdf" or total_pages > 1:
+                        display_page_navigation(total_pages, "PDF" if file_kind == "pdf" else "TIFF")
+                except Exception as e:
+                    st.error(f"Error in {file_kind.upper()} processing: {e}")
+            annotation_canvas(uploaded_file, file_kind, doc_type_options[doc_type], import_file)
+        with col3_input_filed:
+            metadata_form(uploaded_file, doc_type_options[doc_type])
+
+    session_total, global_total = enforce_memory_limits()
+    display_memory_usage(session_total, global_total)
+    report_startup(prewarm_state, run_started)
 
 if __name__ == "__main__":
     main()
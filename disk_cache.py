@@ -0,0 +1,169 @@
+import os
+import mmap
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+
+# Seconds between writes of the batched last-access times of cache hits
+ACCESS_FLUSH_INTERVAL = 10
+
+# Function to build a cache key from a content hash and the parameters that produced a value
+def make_key(*parts):
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+# On-disk cache shared by every process using the same directory.
+# The SQLite index (WAL mode) tracks size and last access of each entry, and triggers keep the
+# total size in a one-row table so that it is never recomputed. Values live in blob files that
+# are written to a temporary file and renamed into place, so readers never see a partial blob,
+# and are handed to the decoder as an mmap. Hits only read the index: their access times are
+# batched in memory and written at most every ACCESS_FLUSH_INTERVAL seconds and before eviction.
+class DiskCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._access_lock = threading.Lock()
+        self._pending_access = {}
+        self._last_flush = time.monotonic()
+        os.makedirs(os.path.join(directory, "blobs"), exist_ok=True)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, size INTEGER NOT NULL, created REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+            conn.execute("CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)")
+            # Seeded from the entries of a cache created before the totals table existed
+            conn.execute("INSERT OR IGNORE INTO totals (id, size) SELECT 0, COALESCE(SUM(size), 0) FROM entries")
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries "
+                "BEGIN UPDATE totals SET size = size + new.size WHERE id = 0; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries "
+                "BEGIN UPDATE totals SET size = size - old.size WHERE id = 0; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries "
+                "BEGIN UPDATE totals SET size = size - old.size + new.size WHERE id = 0; END"
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+
+    # One connection per thread; SQLite connections must not be shared between threads
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.directory, "index.sqlite3"), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _blob_path(self, key):
+        return os.path.join(self.directory, "blobs", key[:2], key)
+
+    # Function to read an entry: decode gets the mapped blob (read-only, file-like and a buffer) and
+    # must not keep a reference to it. Returns None on a miss.
+    def get(self, key, decode=bytes):
+        conn = self._connect()
+        row = conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            with open(self._blob_path(key), 'rb') as f:
+                if row[0] == 0:
+                    value = decode(b"")
+                else:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        value = decode(mapped)
+        except (OSError, ValueError):
+            # The blob was evicted by another process between the index lookup and the read
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return None
+        self._touch(key)
+        return value
+
+    # Function to record the access time of a hit, writing the batch once it is due
+    def _touch(self, key):
+        now = time.monotonic()
+        with self._access_lock:
+            self._pending_access[key] = time.time()
+            due = now - self._last_flush >= ACCESS_FLUSH_INTERVAL
+        if due:
+            self.flush_access_times()
+
+    # Function to write the batched access times in one transaction
+    def flush_access_times(self):
+        with self._access_lock:
+            pending, self._pending_access = self._pending_access, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("UPDATE entries SET last_access = MAX(last_access, ?) WHERE key = ?", [(accessed, key) for key, accessed in pending.items()])
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+
+    def set(self, key, data):
+        path = self._blob_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        now = time.time()
+        # An upsert rather than INSERT OR REPLACE: the replaced row's delete would not fire the totals trigger
+        self._connect().execute(
+            "INSERT INTO entries (key, size, created, last_access) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET size = excluded.size, created = excluded.created, last_access = excluded.last_access",
+            (key, len(data), now, now),
+        )
+        self.evict()
+
+    # Remove least recently used entries until the cache is back under 90% of its size limit
+    def evict(self):
+        if self.total_size() <= self.max_bytes:
+            return
+        # Recent hits must count before the least recently used entries are chosen
+        self.flush_access_times()
+        target = self.max_bytes * 0.9
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            total = self.total_size()
+            removed = []
+            for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+                if total <= target:
+                    break
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                removed.append(key)
+                total -= size
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        for key in removed:
+            try:
+                os.remove(self._blob_path(key))
+            except OSError:
+                pass
+
+    def total_size(self):
+        return self._connect().execute("SELECT size FROM totals WHERE id = 0").fetchone()[0]
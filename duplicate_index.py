@@ -0,0 +1,158 @@
+import io
+import re
+import json
+import time
+import sqlite3
+import threading
+from PIL import Image
+
+HASH_BITS = 64
+BAND_BITS = 16
+BANDS = HASH_BITS // BAND_BITS  # any hash within BANDS - 1 bits of another shares at least one band exactly
+MIN_CONTRAST = 8  # grey levels across the 9x8 thumbnail below which a page has no structure to hash
+MIN_BALANCE = 8  # hashes with fewer set or clear bits are too skewed to tell documents apart
+TOKEN_PATTERN = re.compile(r"\d")
+
+
+# Function to compute the 64-bit difference hash (dHash) of an image or encoded image bytes.
+# Blank and near-uniform pages (cover or fax sheets) have no structure to hash and give None.
+def dhash(image):
+    if isinstance(image, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(image))
+    pixels = list(image.convert('L').resize((9, 8), Image.Resampling.LANCZOS).getdata())
+    if max(pixels) - min(pixels) < MIN_CONTRAST:
+        return None
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+# Function to check whether a hash is too uninformative for duplicate detection.
+# Skewed hashes would match unrelated sparse pages and pile up in the same bands of the index.
+def is_low_entropy(value):
+    if value is None:
+        return True
+    set_bits = value.bit_count()
+    return min(set_bits, HASH_BITS - set_bits) < MIN_BALANCE
+
+# Function to get the content tokens of a page from its OCR words: the distinct words containing a digit
+# (amounts, dates, invoice and order numbers), which tell apart documents sharing a layout or template
+def content_tokens(texts):
+    return sorted({text.strip().casefold() for text in texts if TOKEN_PATTERN.search(text)})
+
+
+# Function to get the Jaccard similarity of two token lists; None when either has no tokens
+def token_similarity(tokens, other):
+    if not tokens or not other:
+        return None
+    tokens, other = set(tokens), set(other)
+    return len(tokens & other) / len(tokens | other)
+
+
+# Function to split a hash into the bands used for exact-match candidate lookup
+def get_bands(value):
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (band * BAND_BITS)) & mask for band in range(BANDS)]
+
+
+# Function to convert between unsigned hashes and SQLite's signed 64-bit integers
+def to_signed(value):
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+# Index of submitted documents for duplicate lookup.
+# Exact re-uploads are found by the SHA-256 of the file. Near-duplicates (the same document
+# rescanned or re-exported) need a first-page dHash within max_distance bits, the same page count
+# and content tokens at least min_similarity alike: the dHash of a thumbnail only captures the
+# layout, which every document from the same template shares.
+# Multi-index hashing: each hash is split into BANDS indexed bands, so a lookup only compares
+# against the few entries sharing a band instead of scanning the whole index.
+class DuplicateIndex:
+    def __init__(self, path, max_distance=BANDS - 1, min_similarity=1.0):
+        if max_distance >= BANDS:
+            raise ValueError(f"max_distance must be below {BANDS}")
+        self.path = path
+        self.max_distance = max_distance
+        self.min_similarity = min_similarity
+        self._local = threading.local()
+        conn = self._connect()
+        band_columns = ", ".join(f"band{band} INTEGER NOT NULL" for band in range(BANDS))
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            f"id INTEGER PRIMARY KEY, hash INTEGER NOT NULL, {band_columns}, "
+            "page_count INTEGER NOT NULL, file_name TEXT, doctype_id TEXT, submitted_at REAL NOT NULL, tokens TEXT)"
+        )
+        # Indexes created before the content tokens were stored
+        if "tokens" not in [row[1] for row in conn.execute("PRAGMA table_info(documents)")]:
+            conn.execute("ALTER TABLE documents ADD COLUMN tokens TEXT")
+        for band in range(BANDS):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS documents_band{band} ON documents (band{band})")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS contents ("
+            "id INTEGER PRIMARY KEY, sha256 TEXT NOT NULL, file_name TEXT, doctype_id TEXT, submitted_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS contents_sha256 ON contents (sha256)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, value, page_count, file_name, doctype_id, sha256, tokens=()):
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO contents (sha256, file_name, doctype_id, submitted_at) VALUES (?, ?, ?, ?)",
+            (sha256, file_name, str(doctype_id), now),
+        )
+        if is_low_entropy(value):
+            return
+        band_columns = ", ".join(f"band{band}" for band in range(BANDS))
+        placeholders = ", ".join("?" for _ in range(BANDS + 6))
+        conn.execute(
+            f"INSERT INTO documents (hash, {band_columns}, page_count, file_name, doctype_id, submitted_at, tokens) VALUES ({placeholders})",
+            (to_signed(value), *get_bands(value), page_count, file_name, str(doctype_id), now, json.dumps(list(tokens))),
+        )
+
+    # Function to find previously submitted copies of a document: exact re-uploads ("exact") first,
+    # then near-duplicates ("near"), closest first. Low-entropy hashes and pages without content
+    # tokens are never reported as near-duplicates.
+    def find(self, value, page_count=None, sha256=None, tokens=()):
+        conn = self._connect()
+        matches = [
+            {"kind": "exact", "distance": 0, "similarity": 1.0, "file_name": file_name, "doctype_id": doctype_id, "submitted_at": submitted_at}
+            for file_name, doctype_id, submitted_at in conn.execute(
+                "SELECT file_name, doctype_id, submitted_at FROM contents WHERE sha256 = ? ORDER BY submitted_at DESC", (sha256,)
+            )
+        ] if sha256 else []
+        if is_low_entropy(value) or not tokens:
+            return matches
+        query = " UNION ".join(
+            f"SELECT hash, page_count, file_name, doctype_id, submitted_at, tokens FROM documents WHERE band{band} = ?"
+            for band in range(BANDS)
+        )
+        near = []
+        for stored, stored_page_count, file_name, doctype_id, submitted_at, stored_tokens in conn.execute(query, get_bands(value)):
+            distance = (to_unsigned(stored) ^ value).bit_count()
+            if distance > self.max_distance or (page_count is not None and stored_page_count != page_count):
+                continue
+            similarity = token_similarity(tokens, json.loads(stored_tokens or "[]"))
+            if similarity is not None and similarity >= self.min_similarity:
+                near.append({
+                    "kind": "near",
+                    "distance": distance,
+                    "similarity": similarity,
+                    "file_name": file_name,
+                    "doctype_id": doctype_id,
+                    "submitted_at": submitted_at,
+                })
+        return matches + sorted(near, key=lambda match: (match["distance"], -match["similarity"]))
@@ -0,0 +1,96 @@
+import numpy as np
+
+# Text-block proposals for a page image given as a 2-D grayscale array.
+# The page is binarized against its local mean (robust to shadows in phone photos), ink is smeared
+# across gaps narrower than the word spacing, and the connected components of the smeared ink,
+# filtered by size, are the proposed blocks.
+
+
+# Function to binarize a grayscale image against the mean of a window around each pixel
+def binarize(gray, window=31, offset=12):
+    gray = gray.astype(np.float64)
+    height, width = gray.shape
+    integral = np.pad(gray.cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+    radius = window // 2
+    y0 = np.clip(np.arange(height) - radius, 0, height)
+    y1 = np.clip(np.arange(height) + radius + 1, 0, height)
+    x0 = np.clip(np.arange(width) - radius, 0, width)
+    x1 = np.clip(np.arange(width) + radius + 1, 0, width)
+    sums = integral[y1][:, x1] - integral[y0][:, x1] - integral[y1][:, x0] + integral[y0][:, x0]
+    area = (y1 - y0)[:, None] * (x1 - x0)[None, :]
+    return gray < sums / area - offset
+
+
+# Function to fill background runs of at most max_gap pixels between ink pixels along each row
+def smear_rows(ink, max_gap):
+    width = ink.shape[1]
+    columns = np.arange(width)
+    last_ink = np.maximum.accumulate(np.where(ink, columns, -width - max_gap), axis=1)
+    next_ink = np.minimum.accumulate(np.where(ink, columns, 2 * width + max_gap)[:, ::-1], axis=1)[:, ::-1]
+    return ink | (next_ink - last_ink - 1 <= max_gap)
+
+
+# Function to get the bounding boxes (x, y, w, h) of the 8-connected components of a mask
+def component_boxes(mask):
+    edges = np.diff(np.pad(mask.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    count = len(rows)
+    if not count:
+        return []
+
+    # Runs on consecutive rows that overlap (or touch diagonally) are connected. Keys offset by row make
+    # starts and ends globally sorted, so each run's overlapping runs in the row above are one slice.
+    stride = mask.shape[1] + 2
+    start_keys = rows * stride + starts
+    end_keys = rows * stride + ends
+    first = np.searchsorted(end_keys, (rows - 1) * stride + starts, side='left')
+    last = np.searchsorted(start_keys, (rows - 1) * stride + ends, side='right')
+    counts = np.maximum(last - first, 0)
+    below = np.repeat(np.arange(count), counts)
+    above = np.repeat(first, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    # Connected components by hooking the larger root of each pair onto the smaller one and
+    # compressing paths, until both runs of every pair have the same root
+    roots = np.arange(count)
+    while True:
+        root_above, root_below = roots[above], roots[below]
+        unmerged = root_above != root_below
+        if not unmerged.any():
+            break
+        np.minimum.at(roots, np.maximum(root_above, root_below)[unmerged], np.minimum(root_above, root_below)[unmerged])
+        while True:
+            compressed = roots[roots]
+            if np.array_equal(compressed, roots):
+                break
+            roots = compressed
+
+    labels, inverse = np.unique(roots, return_inverse=True)
+    left = np.full(len(labels), mask.shape[1])
+    right = np.zeros(len(labels), dtype=np.int64)
+    top = np.full(len(labels), mask.shape[0])
+    bottom = np.zeros(len(labels), dtype=np.int64)
+    np.minimum.at(left, inverse, starts)
+    np.maximum.at(right, inverse, ends)
+    np.minimum.at(top, inverse, rows)
+    np.maximum.at(bottom, inverse, rows + 1)
+    return [(int(x0), int(y0), int(x1 - x0), int(y1 - y0)) for x0, y0, x1, y1 in zip(left, top, right, bottom)]
+
+
+# Function to propose text-block boxes (x, y, w, h)
+def propose_text_blocks(gray, word_gap=None, min_size=6, min_density=0.08, max_density=0.6):
+    height, width = gray.shape
+    ink = binarize(gray)
+    # Dot-matrix and broken glyphs are joined vertically before words are joined horizontally
+    ink = smear_rows(ink.T, 2).T
+    integral = np.pad(ink.cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+
+    def is_text(x, y, w, h):
+        density = (integral[y + h, x + w] - integral[y, x + w] - integral[y + h, x] + integral[y, x]) / (w * h)
+        return min_size <= h <= height // 10 and min_size <= w <= width * 0.9 and w <= h * 25 and min_density <= density <= max_density
+
+    if word_gap is None:
+        # Words are joined across gaps up to the typical glyph height
+        glyph_heights = [h for x, y, w, h in component_boxes(smear_rows(ink, 2)) if is_text(x, y, w, h)]
+        word_gap = int(np.median(glyph_heights)) if glyph_heights else max(4, width // 60)
+    return [box for box in component_boxes(smear_rows(ink, word_gap)) if is_text(*box)]
@@ -0,0 +1,204 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from mock_dms_server import create_server
+
+# Full-rerun cost of app.py under concurrent script runs.
+#
+# Each simulated operator drives the script with AppTest: select a document type, upload and page
+# through the document, then fill the metadata form and submit. AppTest swaps a process-wide
+# runtime on every run, so each session runs in its own process with its own in-memory caches and
+# thread pools. What this measures is the cost of full script reruns in N independent processes
+# competing for the host (CPU, disk cache, DMS). It does not measure how many operators one server
+# process can hold: shared render caches, the preprocessing pool and GIL contention between
+# sessions are never exercised.
+#
+# AppTest always reruns the whole script, so only interactions that fully rerun the real app are
+# timed (first render, document type, upload, page navigation). Field edits and submission run in
+# fragments in the real app and drawing goes through the canvas component, which AppTest cannot
+# drive; the form is filled and submitted untimed so that the submission path still runs.
+# The EDMS catalog and the DMS submission endpoint are served by mock_dms_server unless
+# --edms-url/--dms-url point elsewhere. The report has rerun latency percentiles per step, CPU
+# time and the peak RSS of each process.
+SCOPE_NOTE = (
+    "full script reruns in N single-session processes; not the capacity of one server process "
+    "(no shared caches, preprocessing pool or GIL contention), and no fragment reruns or canvas drawing"
+)
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+MIME_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".pdf": "application/pdf", ".tif": "image/tiff", ".tiff": "image/tiff"}
+
+
+# Function to run one rerun of a session and record its latency under a step name
+def timed_run(at, step, latencies, errors):
+    started = time.perf_counter()
+    at.run()
+    latencies.setdefault(step, []).append(time.perf_counter() - started)
+    if at.exception:
+        errors.append(f"{step}: {at.exception[0].value}")
+
+
+# Function to drive one simulated operator session
+def run_session(session_index, args, document, work_dir):
+    from streamlit.testing.v1 import AppTest
+
+    # The app writes data.json to its working directory
+    os.chdir(work_dir)
+    latencies = {}
+    errors = []
+    name, file_bytes = document
+    for iteration in range(args.iterations):
+        at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+        timed_run(at, "first_render", latencies, errors)
+        if not at.selectbox:
+            errors.append("first_render: no document types")
+            break
+
+        options = at.selectbox(key="doc_type").options
+        at.selectbox(key="doc_type").set_value(options[(session_index + iteration) % len(options)])
+        timed_run(at, "select_doctype", latencies, errors)
+
+        # Distinct file names keep the sessions' form keys and queue entries apart
+        stem, extension = os.path.splitext(name)
+        at.file_uploader(key="uploaded_file").set_value((f"{stem}_{session_index}_{iteration}{extension}", file_bytes, MIME_TYPES.get(extension.lower(), "application/octet-stream")))
+        timed_run(at, "upload", latencies, errors)
+
+        for _ in range(args.pages - 1):
+            next_buttons = [button for button in at.button if button.key == "next_page"]
+            if not next_buttons:
+                break
+            next_buttons[0].click()
+            timed_run(at, "next_page", latencies, errors)
+
+        # Fragment reruns in the real app: not timed
+        for text_input in at.text_input:
+            text_input.set_value("2024-01-01" if "Date" in text_input.label else f"LOAD-{session_index}-{iteration}")
+        at.run()
+        submit_buttons = [button for button in at.button if button.label == "Done and Submit"]
+        if submit_buttons:
+            submit_buttons[0].click()
+            at.run()
+            if at.exception or at.error:
+                errors.append(f"submit: {(at.exception or at.error)[0].value}")
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "latencies": latencies,
+        "errors": [f"session {session_index}: {message}" for message in errors],
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+        "rss_peak": usage.ru_maxrss * 1024,
+    }
+
+
+# Function to get a percentile of a sorted list
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))] if sorted_values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-rerun cost of the Streamlit app in concurrent single-session processes")
+    parser.add_argument("--sessions", type=int, default=4, help="number of concurrent single-session processes")
+    parser.add_argument("--iterations", type=int, default=1, help="documents processed by each operator")
+    parser.add_argument("--document", default=os.path.join(os.path.dirname(APP_PATH), "docs", "image", "receipt_00001.png"))
+    parser.add_argument("--pages", type=int, default=2, help="pages to visit in multi-page documents")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="seconds over which the sessions are started")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds allowed for one rerun")
+    parser.add_argument("--edms-url", help="EDMS API base URL (default: in-process mock)")
+    parser.add_argument("--dms-url", help="DMS API base URL (default: in-process mock)")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args()
+
+    server = None
+    if not args.edms_url or not args.dms_url:
+        server = create_server(port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        mock_url = f"http://127.0.0.1:{server.server_address[1]}/api"
+    work_dir = tempfile.mkdtemp(prefix="load_test_")
+    # Set before the session processes are started so that they inherit it
+    os.environ.update({
+        "EDMS_API_URL": args.edms_url or f"{mock_url}/v4",
+        "DMS_API_URL": args.dms_url or mock_url,
+        "DUPLICATE_POLICY": "off",
+        # The session processes would all try to bind the same metrics port
+        "METRICS_PORT": "0",
+        "EXPORT_DIR": os.path.join(work_dir, "exports"),
+        "DISK_CACHE_DIR": os.environ.get("DISK_CACHE_DIR", os.path.join(work_dir, "cache")),
+    })
+
+    with open(args.document, 'rb') as f:
+        document = (os.path.basename(args.document), f.read())
+
+    started = time.perf_counter()
+    # Spawned rather than forked: the parent runs the mock server thread
+    with ProcessPoolExecutor(max_workers=args.sessions, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = []
+        for index in range(args.sessions):
+            futures.append(executor.submit(run_session, index, args, document, work_dir))
+            if args.ramp_up and args.sessions > 1:
+                time.sleep(args.ramp_up / (args.sessions - 1))
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - started
+
+    latencies = {}
+    errors = []
+    for result in results:
+        errors += result["errors"]
+        for step, values in result["latencies"].items():
+            latencies.setdefault(step, []).extend(values)
+    cpu_seconds = sum(result["cpu_seconds"] for result in results)
+    rss_peaks = [result["rss_peak"] for result in results]
+
+    report = {
+        "sessions": args.sessions,
+        "iterations": args.iterations,
+        "elapsed": elapsed,
+        "cpu_seconds": cpu_seconds,
+        "cpu_utilisation": cpu_seconds / elapsed if elapsed else 0.0,
+        "scope": SCOPE_NOTE,
+        "rss_peak_per_process": max(rss_peaks),
+        "rss_peak_sum": sum(rss_peaks),
+        "submitted": len(server.state.documents) if server else None,
+        "errors": errors,
+        "steps": {},
+    }
+    all_latencies = sorted(value for values in latencies.values() for value in values)
+    for step, values in list(latencies.items()) + [("all", all_latencies)]:
+        values = sorted(values)
+        report["steps"][step] = {
+            "reruns": len(values),
+            "p50": percentile(values, 0.50),
+            "p90": percentile(values, 0.90),
+            "p99": percentile(values, 0.99),
+            "max": values[-1] if values else 0.0,
+        }
+
+    print(f"{args.sessions} single-session processes x {args.iterations} documents in {elapsed:.1f}s, "
+          f"CPU {cpu_seconds:.1f}s ({report['cpu_utilisation']:.0%} of one core), "
+          f"peak RSS {report['rss_peak_per_process'] / 2 ** 20:.0f} MB per process, sum of peaks {report['rss_peak_sum'] / 2 ** 20:.0f} MB")
+    print(f"  scope: {SCOPE_NOTE}")
+    for step, stats in report["steps"].items():
+        print(f"  {step:<15} {stats['reruns']:>5} reruns  p50 {stats['p50'] * 1000:8.1f} ms  "
+              f"p90 {stats['p90'] * 1000:8.1f} ms  p99 {stats['p99'] * 1000:8.1f} ms  max {stats['max'] * 1000:8.1f} ms")
+    if report["submitted"] is not None:
+        print(f"  submitted to mock DMS: {report['submitted']}")
+    for message in errors:
+        print(f"  error: {message}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if server:
+        server.shutdown()
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the EDMS document type catalog and the DMS submission API (processBase64File),
+# including the chunked upload mode. Run it and point the app at it with
+# EDMS_API_URL=http://localhost:8502/api/v4 DMS_API_URL=http://localhost:8502/api (and UPLOAD_MODE=chunked).
+
+UPLOAD_PATH = re.compile(r"^/api/processBase64File/uploads/([0-9a-f]+)(/complete)?$")
+CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+METADATA_TYPES_PATH = re.compile(r"^/api/v4/document_types/(\d+)/metadata_types/$")
+DOCUMENT_TYPES_PAGE_SIZE = 2
+
+DOCUMENT_TYPES = [
+    {"id": 1, "label": "Invoice"},
+    {"id": 2, "label": "Receipt"},
+    {"id": 3, "label": "Purchase order"},
+]
+
+METADATA_TYPES = [
+    {"required": True, "metadata_type": {"id": 11, "label": "Document number", "lookup": "", "validation": "", "validation_arguments": ""}},
+    {"required": False, "metadata_type": {
+        "id": 12, "label": "Date", "lookup": "",
+        "validation": "mayan.apps.metadata.validators.RegularExpressionValidator",
+        "validation_arguments": "{'pattern': '^\\\\d{4}-\\\\d{2}-\\\\d{2}$'}",
+    }},
+    {"required": True, "metadata_type": {"id": 13, "label": "Total", "lookup": "", "validation": "", "validation_arguments": ""}},
+    {"required": False, "metadata_type": {"id": 14, "label": "Currency", "lookup": "USD,EUR,VND", "validation": "", "validation_arguments": ""}},
+]
+
+
+class MockDMSState:
+    def __init__(self, drop_rate=0.0):
+        self.lock = threading.Lock()
+        self.drop_rate = drop_rate
+        self.uploads = {}
+        self.documents = []
+        self.dropped = 0
+
+
+class MockDMSHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def read_json(self):
+        try:
+            return json.loads(self.read_body() or b"{}")
+        except json.JSONDecodeError:
+            return None
+
+    # Simulate a flaky link by dropping the connection without a response
+    def maybe_drop(self):
+        if self.state.drop_rate and random.random() < self.state.drop_rate:
+            with self.state.lock:
+                self.state.dropped += 1
+            self.close_connection = True
+            self.connection.close()
+            return True
+        return False
+
+    def store_document(self, metadata, file_bytes):
+        with self.state.lock:
+            self.state.documents.append({
+                "file_name": metadata.get('file_name'),
+                "doctype_id": metadata.get('doctype_id'),
+                "docmeta_data": metadata.get('docmeta_data', []),
+                "size": len(file_bytes),
+                "sha256": hashlib.sha256(file_bytes).hexdigest(),
+            })
+            return len(self.state.documents)
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if path == "/api/v4/document_types/":
+            page = int(query.partition("page=")[2] or 1)
+            start = (page - 1) * DOCUMENT_TYPES_PAGE_SIZE
+            has_next = start + DOCUMENT_TYPES_PAGE_SIZE < len(DOCUMENT_TYPES)
+            host = self.headers.get('Host', f"{self.server.server_address[0]}:{self.server.server_address[1]}")
+            return self.send_json(200, {
+                "count": len(DOCUMENT_TYPES),
+                "next": f"http://{host}{path}?page={page + 1}" if has_next else None,
+                "results": DOCUMENT_TYPES[start:start + DOCUMENT_TYPES_PAGE_SIZE],
+            })
+        if METADATA_TYPES_PATH.match(path):
+            return self.send_json(200, {"count": len(METADATA_TYPES), "next": None, "results": METADATA_TYPES})
+
+        match = UPLOAD_PATH.match(self.path)
+        if not match or match.group(2):
+            return self.send_json(404, {"error": "not found"})
+        upload = self.state.uploads.get(match.group(1))
+        if upload is None:
+            return self.send_json(404, {"error": "unknown upload"})
+        self.send_json(200, {"offset": len(upload['data'])})
+
+    def do_POST(self):
+        if self.path == "/api/processBase64File":
+            data = self.read_json()
+            if not data or 'file_base64' not in data:
+                return self.send_json(400, {"error": "file_base64 is required"})
+            try:
+                file_bytes = base64.b64decode(data['file_base64'], validate=True)
+            except ValueError:
+                return self.send_json(400, {"error": "invalid base64"})
+            document_id = self.store_document(data, file_bytes)
+            return self.send_json(200, {"status": "ok", "document_id": document_id, "size": len(file_bytes)})
+
+        if self.path == "/api/processBase64File/uploads":
+            data = self.read_json()
+            if not data or not {'file_name', 'size', 'sha256'} <= data.keys():
+                return self.send_json(400, {"error": "file_name, size and sha256 are required"})
+            with self.state.lock:
+                # Resume an unfinished upload of the same file
+                for upload_id, upload in self.state.uploads.items():
+                    if upload['sha256'] == data['sha256'] and upload['size'] == data['size']:
+                        return self.send_json(200, {"upload_id": upload_id, "offset": len(upload['data'])})
+                upload_id = uuid.uuid4().hex
+                self.state.uploads[upload_id] = {"sha256": data['sha256'], "size": data['size'], "data": bytearray()}
+            return self.send_json(201, {"upload_id": upload_id, "offset": 0})
+
+        match = UPLOAD_PATH.match(self.path)
+        if match and match.group(2):
+            metadata = self.read_json() or {}
+            with self.state.lock:
+                upload = self.state.uploads.get(match.group(1))
+                if upload is None:
+                    return self.send_json(404, {"error": "unknown upload"})
+                if len(upload['data']) != upload['size'] or hashlib.sha256(upload['data']).hexdigest() != upload['sha256']:
+                    return self.send_json(409, {"error": "upload incomplete or corrupted", "offset": len(upload['data'])})
+                del self.state.uploads[match.group(1)]
+            document_id = self.store_document(metadata, bytes(upload['data']))
+            return self.send_json(200, {"status": "ok", "document_id": document_id, "size": upload['size']})
+
+        self.send_json(404, {"error": "not found"})
+
+    def do_PUT(self):
+        match = UPLOAD_PATH.match(self.path)
+        if not match or match.group(2):
+            return self.send_json(404, {"error": "not found"})
+        chunk = self.read_body()
+        if self.maybe_drop():
+            return
+        content_range = CONTENT_RANGE.match(self.headers.get('Content-Range', ''))
+        if not content_range:
+            return self.send_json(400, {"error": "Content-Range is required"})
+        start, end, total = (int(value) for value in content_range.groups())
+        with self.state.lock:
+            upload = self.state.uploads.get(match.group(1))
+            if upload is None:
+                return self.send_json(404, {"error": "unknown upload"})
+            offset = len(upload['data'])
+            if start != offset or total != upload['size']:
+                return self.send_json(409, {"error": "unexpected offset", "offset": offset})
+            if end - start + 1 != len(chunk) or hashlib.sha256(chunk).hexdigest() != self.headers.get('X-Chunk-SHA256'):
+                return self.send_json(422, {"error": "chunk checksum mismatch", "offset": offset})
+            upload['data'].extend(chunk)
+            offset = len(upload['data'])
+        self.send_json(200, {"offset": offset})
+
+
+def create_server(host="127.0.0.1", port=8502, drop_rate=0.0):
+    server = ThreadingHTTPServer((host, port), MockDMSHandler)
+    server.state = MockDMSState(drop_rate)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the EDMS document type catalog and the DMS submission API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of chunk uploads dropped without a response")
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.drop_rate)
+    print(f"Mock DMS listening on http://{args.host}:{args.port}/api")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import argparse
+import glob
+import itertools
+import json
+import os
+import sys
+import time
+
+import pytesseract
+from PIL import Image
+
+from roi_ocr import PREPROCESSING, ocr_page_words, ocr_region, render_pdf_page, words_in_rect
+
+# OCR accuracy and speed benchmark over ground-truth word boxes in the docs/json format.
+#
+# A corpus is either a directory laid out like docs/ (json/<name>.json next to image/<name>.png)
+# or JSONL shards written by the app's dataset export (meta.image_ref points to the source file).
+# Every box is OCRed with the app's region OCR under each combination of DPI, preprocessing, PSM
+# and language. In page mode each page is OCRed once into word boxes and a box's text is taken from
+# the words inside it, which is how the app fills boxes on pre-OCRed queued documents. The report has
+# the character error rate, latency percentiles per OCR call (box or page) and box throughput.
+# With --baseline, the run fails (exit code 1) when a config regresses beyond the thresholds or has
+# no baseline entry.
+
+IMAGE_EXTENSIONS = [".png", ".jpg", ".jpeg", ".tif", ".tiff"]
+
+
+# Function to compute the Levenshtein distance between two strings
+def edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+# Function to normalize whitespace before comparing OCR output to the ground truth
+def normalize(text):
+    return " ".join(text.split())
+
+
+# Function to get a percentile of a sorted list
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+# Function to load (record, image loader) pairs from a docs-style directory
+def load_docs_corpus(corpus):
+    samples = []
+    for json_path in sorted(glob.glob(os.path.join(corpus, "json", "*.json"))):
+        stem = os.path.splitext(os.path.basename(json_path))[0]
+        image_path = next((path for path in (os.path.join(corpus, "image", stem + ext) for ext in IMAGE_EXTENSIONS) if os.path.exists(path)), None)
+        if image_path is None:
+            print(f"Skipping {json_path}: no image found", file=sys.stderr)
+            continue
+        with open(json_path) as f:
+            samples.append((json.load(f), {"path": image_path, "page": 0}))
+    return samples
+
+
+# Function to load (record, image reference) pairs from JSONL export shards
+def load_export_corpus(shard_paths):
+    samples = []
+    for shard_path in shard_paths:
+        export_dir = os.path.dirname(shard_path)
+        with open(shard_path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    image_ref = record['meta']['image_ref']
+                    samples.append((record, {"path": os.path.join(export_dir, image_ref['path']), "page": image_ref.get('page', 0)}))
+    return samples
+
+
+# Function to load the image of a sample at the given DPI (relative to source_dpi for raster images)
+def load_sample_image(image_ref, dpi, source_dpi):
+    path, page = image_ref['path'], image_ref['page']
+    if path.lower().endswith(".pdf"):
+        import fitz  # PyMuPDF
+        with fitz.open(path) as doc:
+            return render_pdf_page(doc, page, dpi)
+    with Image.open(path) as img:
+        img.seek(page)
+        img = img.convert('RGB')
+    if dpi != source_dpi:
+        scale = dpi / source_dpi
+        img = img.resize((round(img.width * scale), round(img.height * scale)), Image.Resampling.LANCZOS)
+    return img
+
+
+# Function to run one config over the corpus
+def run_config(samples, config, source_dpi):
+    errors = 0
+    reference_chars = 0
+    latencies = []
+    started = time.perf_counter()
+    boxes = 0
+    for record, image_ref in samples:
+        img = load_sample_image(image_ref, config['dpi'], source_dpi)
+        size = record['meta']['image_size']
+        scale_x = img.width / size['width']
+        scale_y = img.height / size['height']
+        if config['mode'] == "page":
+            page_started = time.perf_counter()
+            page_words = ocr_page_words(pytesseract, img, config['lang'], config['psm'], config['preprocessing'])
+            latencies.append(time.perf_counter() - page_started)
+        for word in record['words']:
+            rect = word['rect']
+            region = {
+                "left": round(rect['x1'] * scale_x),
+                "top": round(rect['y1'] * scale_y),
+                "width": round((rect['x2'] - rect['x1']) * scale_x),
+                "height": round((rect['y2'] - rect['y1']) * scale_y),
+            }
+            boxes += 1
+            if config['mode'] == "page":
+                text = words_in_rect(page_words, region)
+            else:
+                box_started = time.perf_counter()
+                text = ocr_region(pytesseract, img, region, config['lang'], config['psm'], config['preprocessing'])
+                latencies.append(time.perf_counter() - box_started)
+            reference = normalize(word['value'])
+            errors += edit_distance(normalize(text), reference)
+            reference_chars += len(reference)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "boxes": boxes,
+        "cer": errors / max(reference_chars, 1),
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p90": percentile(latencies, 0.90),
+        "latency_p99": percentile(latencies, 0.99),
+        "throughput": boxes / elapsed if elapsed else 0.0,
+    }
+
+
+# Function to get the name of a config, used as its key in reports and baselines
+def config_name(config):
+    name = f"dpi={config['dpi']},pre={config['preprocessing']},psm={config['psm'] or 'default'},lang={config['lang']}"
+    return name if config['mode'] == "region" else f"mode={config['mode']},{name}"
+
+
+# Function to compare results to a baseline and return the regression messages
+def find_regressions(results, baseline, max_cer_increase, max_latency_increase):
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            regressions.append(f"{name}: no baseline entry (record one with --write-baseline)")
+            continue
+        if result['cer'] > base['cer'] + max_cer_increase:
+            regressions.append(f"{name}: CER {result['cer']:.3f} vs baseline {base['cer']:.3f}")
+        if result['latency_p50'] > base['latency_p50'] * (1 + max_latency_increase):
+            regressions.append(f"{name}: p50 latency {result['latency_p50'] * 1000:.1f} ms vs baseline {base['latency_p50'] * 1000:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR accuracy and speed benchmark on ground-truth word boxes")
+    parser.add_argument("corpus", nargs="+", help="docs-style directory (json/ + image/) or export .jsonl shards")
+    parser.add_argument("--dpi", type=int, nargs="+", default=[300])
+    parser.add_argument("--source-dpi", type=int, default=300, help="resolution raster images are assumed to be scanned at")
+    parser.add_argument("--preprocessing", nargs="+", default=["none"], choices=sorted(PREPROCESSING))
+    parser.add_argument("--mode", nargs="+", default=["region"], choices=["region", "page"], help="OCR each box, or the whole page once (pre-OCR of queued documents)")
+    parser.add_argument("--psm", type=int, nargs="+", default=[None])
+    parser.add_argument("--lang", nargs="+", default=["eng"])
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="baseline results to compare against")
+    parser.add_argument("--write-baseline", action="store_true", help="write the results to --baseline instead of comparing")
+    parser.add_argument("--max-cer-increase", type=float, default=0.02, help="allowed absolute CER increase")
+    parser.add_argument("--max-latency-increase", type=float, default=0.25, help="allowed relative p50 latency increase")
+    args = parser.parse_args()
+
+    samples = []
+    for corpus in args.corpus:
+        samples += load_export_corpus([corpus]) if corpus.endswith(".jsonl") else load_docs_corpus(corpus)
+    if not samples:
+        parser.error("no samples found")
+
+    results = {}
+    for mode, dpi, preprocessing, psm, lang in itertools.product(args.mode, args.dpi, args.preprocessing, args.psm, args.lang):
+        config = {"mode": mode, "dpi": dpi, "preprocessing": preprocessing, "psm": psm, "lang": lang}
+        result = run_config(samples, config, args.source_dpi)
+        results[config_name(config)] = result
+        print(
+            f"{config_name(config)}: {result['boxes']} boxes, CER {result['cer']:.3f}, "
+            f"p50 {result['latency_p50'] * 1000:.1f} ms, p90 {result['latency_p90'] * 1000:.1f} ms, "
+            f"p99 {result['latency_p99'] * 1000:.1f} ms per {'page' if mode == 'page' else 'box'}, {result['throughput']:.1f} boxes/s"
+        )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline and args.write_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.max_cer_increase, args.max_latency_increase)
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
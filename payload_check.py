@@ -0,0 +1,112 @@
+import io
+import sys
+
+import numpy as np
+from PIL import Image, ImageCms
+
+from app import EXIF_ORIENTATION, optimize_payload
+
+# Round-trip check of the payload optimization.
+#
+# Each case runs a generated document through optimize_payload and re-opens the result: it must
+# decode, have the expected size, mode and DPI, carry the EXIF orientation over, and only embed
+# the source's ICC profile when the colour mode did not change.
+
+OPTIONS = {
+    "enabled": True,
+    "png_optimize": True,
+    "jpeg_quality": 85,
+    "webp_quality": None,
+    "max_dpi": 300,
+    "pdf_recompress": True,
+}
+
+
+# Function to make a scan-like image: a light page with dark text lines and some noise
+def make_page(width, height, mode="RGB", seed=0):
+    rng = np.random.default_rng(seed)
+    pixels = np.full((height, width, 3), 235, dtype=np.uint8)
+    for top in range(height // 10, height - height // 10, max(height // 40, 4)):
+        pixels[top:top + max(height // 120, 2), width // 10:width - width // 5] = 30
+    pixels = np.clip(pixels.astype(np.int16) + rng.integers(-12, 12, pixels.shape), 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels).convert(mode)
+
+
+# Function to encode an image with the given save options
+def encode(img, **save_options):
+    output = io.BytesIO()
+    img.save(output, **save_options)
+    return output.getvalue()
+
+
+# Function to get the colour space field of an ICC profile header
+def profile_colour_space(icc_profile):
+    return icc_profile[16:20].decode('ascii').strip() if icc_profile else None
+
+
+# Function to optimize a document, re-open the result and return it with the list of failures
+def round_trip(name, file_bytes, file_kind, options, expected_size, expected_mode):
+    optimized, file_name = optimize_payload(file_bytes, name, file_kind, options)
+    try:
+        img = Image.open(io.BytesIO(optimized))
+        img.load()
+    except Exception as e:
+        return None, [f"{name}: optimized file does not decode: {e}"]
+    failures = []
+    if optimized is file_bytes:
+        failures.append(f"{name}: the original was kept")
+    if img.size != expected_size:
+        failures.append(f"{name}: size {img.size}, expected {expected_size}")
+    if img.mode != expected_mode:
+        failures.append(f"{name}: mode {img.mode}, expected {expected_mode}")
+    print(f"{name} -> {file_name}: {len(file_bytes) / 1024:.0f} KB -> {len(optimized) / 1024:.0f} KB, {img.size[0]}x{img.size[1]} {img.mode}")
+    return img, failures
+
+
+# Function to check a 600 dpi TIFF downscaled to 300 dpi
+def check_tiff_downscale():
+    source = make_page(1200, 1600)
+    file_bytes = encode(source, format='TIFF', dpi=(600, 600))
+    img, failures = round_trip("scan.tiff", file_bytes, "tiff", OPTIONS, (600, 800), "RGB")
+    if img is not None and round(img.info.get('dpi', (0, 0))[0]) != 300:
+        failures.append(f"scan.tiff: dpi {img.info.get('dpi')}, expected 300")
+    return failures
+
+
+# Function to check that a CMYK JPEG converted to RGB does not keep its CMYK profile
+def check_cmyk_jpeg():
+    # Only the header matters here: the colour space field says CMYK
+    cmyk_profile = bytes(16) + b"CMYK" + bytes(108)
+    file_bytes = encode(make_page(800, 600, "CMYK"), format='JPEG', quality=95, dpi=(600, 600), icc_profile=cmyk_profile)
+    img, failures = round_trip("scan_cmyk.jpg", file_bytes, "image", OPTIONS, (400, 300), "RGB")
+    if img is not None and profile_colour_space(img.info.get('icc_profile')) == "CMYK":
+        failures.append("scan_cmyk.jpg: RGB output embeds the CMYK profile")
+    return failures
+
+
+# Function to check that a rotated RGB photo keeps its orientation and sRGB profile
+def check_rgb_jpeg():
+    srgb_profile = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = 6
+    file_bytes = encode(make_page(800, 600), format='JPEG', quality=95, dpi=(600, 600), exif=exif.tobytes(), icc_profile=srgb_profile)
+    img, failures = round_trip("photo.jpg", file_bytes, "image", OPTIONS, (400, 300), "RGB")
+    if img is not None:
+        if img.getexif().get(EXIF_ORIENTATION) != 6:
+            failures.append(f"photo.jpg: orientation {img.getexif().get(EXIF_ORIENTATION)}, expected 6")
+        if img.info.get('icc_profile') != srgb_profile:
+            failures.append("photo.jpg: sRGB profile was not carried over")
+    return failures
+
+
+def main():
+    failures = check_tiff_downscale() + check_cmyk_jpeg() + check_rgb_jpeg()
+    for message in failures:
+        print(f"FAILED {message}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import io
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+# PDF rasterization, region OCR and page OCR shared by the app and the OCR benchmark
+
+
+# Function to convert a region to grayscale and binarize it at its mean intensity
+def binarize(image):
+    gray = ImageOps.grayscale(image)
+    threshold = int(np.asarray(gray).mean())
+    return gray.point(lambda value: 255 if value > threshold else 0)
+
+
+# Function to rasterize a page of an open PyMuPDF document, sharpened as the app shows and OCRs it
+def render_pdf_page(doc, page_number, dpi):
+    pix = doc.load_page(page_number).get_pixmap(dpi=dpi)
+    img = Image.open(io.BytesIO(pix.tobytes("png")))
+    return img.filter(ImageFilter.SHARPEN)
+
+
+PREPROCESSING = {
+    "none": lambda image: image,
+    "grayscale": ImageOps.grayscale,
+    "sharpen": lambda image: image.filter(ImageFilter.SHARPEN),
+    "binarize": binarize,
+}
+
+
+# Function to OCR a region {left, top, width, height} of a PIL image
+def ocr_region(pytesseract, image, rect, lang='eng', psm=None, preprocessing="none"):
+    left, top, width, height = rect["left"], rect["top"], rect["width"], rect["height"]
+    roi = PREPROCESSING[preprocessing](image.crop((left, top, left + width, top + height)))
+    config = f"--psm {psm}" if psm else ""
+    return pytesseract.image_to_string(np.array(roi), lang=lang, config=config).strip()
+
+
+# Function to OCR a whole page into word boxes (x, y, w, h, text, line)
+def ocr_page_words(pytesseract, image, lang='eng', psm=None, preprocessing="none"):
+    config = f"--psm {psm}" if psm else ""
+    data = pytesseract.image_to_data(np.array(PREPROCESSING[preprocessing](image)), lang=lang, config=config, output_type=pytesseract.Output.DICT)
+    words = []
+    for i, text in enumerate(data['text']):
+        if text.strip():
+            line = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            words.append((data['left'][i], data['top'][i], data['width'][i], data['height'][i], text, line))
+    return words
+
+
+# Function to get the text of the page word boxes whose centers lie in a region {left, top, width, height}
+def words_in_rect(words, rect):
+    left, top, width, height = rect["left"], rect["top"], rect["width"], rect["height"]
+    lines = {}
+    for x, y, w, h, text, line in words:
+        if left <= x + w / 2 <= left + width and top <= y + h / 2 <= top + height:
+            lines.setdefault(line, []).append(text)
+    return "\n".join(" ".join(line_words) for line_words in lines.values())
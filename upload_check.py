@@ -0,0 +1,122 @@
+import argparse
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import threading
+
+import numpy as np
+import requests
+from PIL import Image
+
+from mock_dms_server import create_server
+
+# End-to-end check of the chunked upload mode against mock_dms_server.
+#
+# The app submits a noise image (incompressible, so it spans many chunks) in UPLOAD_MODE=chunked
+# while the stand-in drops a fraction of the chunk requests. The check passes when the document
+# stored by the stand-in has the SHA-256 of the uploaded file, and when a chunk with a wrong
+# X-Chunk-SHA256 is rejected (422) without moving the upload offset.
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+
+# Function to make a PNG of random noise of about the given size
+def make_noise_png(size_kb, seed=0):
+    side = int((size_kb * 1024 / 3) ** 0.5)
+    pixels = np.random.default_rng(seed).integers(0, 256, (side, side, 3), dtype=np.uint8)
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, format='PNG')
+    return output.getvalue()
+
+
+# Function to submit a file through the app and return the error messages of the run
+def submit_through_app(file_bytes, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    at.run()
+    at.file_uploader(key="uploaded_file").set_value(("upload_check.png", file_bytes, "image/png"))
+    at.run()
+    for key in [text_input.key for text_input in at.text_input]:
+        text_input = at.text_input(key=key)
+        text_input.set_value("2024-01-01" if "Date" in text_input.label else "CHECK-1")
+        at.run()
+    submit_buttons = [button for button in at.button if button.label == "Done and Submit"]
+    if not submit_buttons:
+        return ["submit button not found"]
+    submit_buttons[0].click()
+    at.run(timeout=timeout)
+    return [str(exception.value) for exception in at.exception] + [str(error.value) for error in at.error]
+
+
+# Function to check that a chunk with a wrong checksum is rejected without moving the offset
+def check_chunk_checksum(api_url):
+    chunk = b"x" * 1024
+    response = requests.post(f"{api_url}/processBase64File/uploads", json={
+        "file_name": "checksum_check.bin",
+        "size": len(chunk),
+        "sha256": hashlib.sha256(chunk).hexdigest(),
+    }, timeout=10)
+    upload_url = f"{api_url}/processBase64File/uploads/{response.json()['upload_id']}"
+    response = requests.put(upload_url, data=chunk, headers={
+        'Content-Range': f"bytes 0-{len(chunk) - 1}/{len(chunk)}",
+        'X-Chunk-SHA256': hashlib.sha256(b"corrupted").hexdigest(),
+    }, timeout=10)
+    offset = requests.get(upload_url, timeout=10).json()['offset']
+    if response.status_code != 422 or offset != 0:
+        return [f"corrupted chunk answered {response.status_code} with offset {offset}, expected 422 with offset 0"]
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the chunked, resumable upload against the local DMS stand-in")
+    parser.add_argument("--size-kb", type=int, default=300, help="size of the uploaded file")
+    parser.add_argument("--chunk-kb", type=int, default=16, help="upload chunk size")
+    parser.add_argument("--drop-rate", type=float, default=0.3, help="fraction of chunk uploads dropped without a response")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds allowed for the submission")
+    args = parser.parse_args()
+
+    server = create_server(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_address[1]}/api"
+    work_dir = tempfile.mkdtemp(prefix="upload_check_")
+    os.environ.update({
+        "EDMS_API_URL": f"{api_url}/v4",
+        "DMS_API_URL": api_url,
+        "UPLOAD_MODE": "chunked",
+        "UPLOAD_CHUNK_SIZE_KB": str(args.chunk_kb),
+        "DUPLICATE_POLICY": "off",
+        "METRICS_PORT": "0",
+        "EXPORT_DIR": os.path.join(work_dir, "exports"),
+        "DISK_CACHE_DIR": os.path.join(work_dir, "cache"),
+    })
+    # The app writes data.json to its working directory
+    os.chdir(work_dir)
+
+    failures = check_chunk_checksum(api_url)
+
+    file_bytes = make_noise_png(args.size_kb)
+    server.state.drop_rate = args.drop_rate
+    failures += submit_through_app(file_bytes, args.timeout)
+    server.state.drop_rate = 0.0
+
+    documents = [document for document in server.state.documents if document['file_name'] == "upload_check.png"]
+    expected = hashlib.sha256(file_bytes).hexdigest()
+    if len(documents) != 1:
+        failures.append(f"expected 1 stored document, found {len(documents)}")
+    elif documents[0]['sha256'] != expected:
+        failures.append(f"stored document has SHA-256 {documents[0]['sha256']}, expected {expected}")
+    print(f"Uploaded {len(file_bytes) / 1024:.0f} KB in {args.chunk_kb} KB chunks, {server.state.dropped} chunk request(s) dropped")
+
+    server.shutdown()
+    for message in failures:
+        print(f"FAILED {message}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()